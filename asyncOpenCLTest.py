@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+import sys, os, time, argparse, asyncio, subprocess
+import openCLTest, capturedOutput, verdictCache, diagnosticRules
+
+class AsyncOpenCLEnv:
+    def __init__(self, openCLEnv, pollInterval = 0.05):
+        # Configuration, command lines and process groups are shared with the blocking environment
+        self.openCLEnv = openCLEnv
+        self.pollInterval = pollInterval
+        self.semaphores = {}
+
+    def __getattr__(self, name):
+        return getattr(self.openCLEnv, name)
+
+    def getSemaphore(self, key, concurrency):
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(max(concurrency, 1))
+
+        return self.semaphores[key]
+
+    async def startProcess(self, args, env, resourceLimits):
+        if sys.platform == 'win32':
+            # Overlapped pipes are required, the resource usage is not available on Windows anyway
+            proc = await asyncio.create_subprocess_exec(*self.openCLEnv.getLimitedCommand(args, resourceLimits), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, **self.openCLEnv.getProcessOptions())
+            return (proc, proc.stdout, None)
+
+        # Not an asyncio subprocess, the child watcher would reap it before its resource usage is read
+        # Fork and exec block, hence they run in a worker thread
+        starting = asyncio.ensure_future(asyncio.to_thread(self.openCLEnv.startProcess, args, env, text=False, resourceLimits=resourceLimits))
+
+        try:
+            proc = await asyncio.shield(starting)
+            stdout = asyncio.StreamReader()
+            (transport, _) = await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), proc.stdout)
+        except asyncio.CancelledError:
+            # The process is started anyway and must not be left behind
+            proc = await starting
+            self.openCLEnv.killProcess(proc)
+            await self.waitProcess(proc)
+            raise
+
+        return (proc, stdout, transport)
+
+    async def waitProcess(self, proc, resourceLimits = None, timeLimit = None):
+        if isinstance(proc, asyncio.subprocess.Process):
+            await asyncio.wait_for(proc.wait(), timeLimit)
+            return None
+
+        return await asyncio.to_thread(self.openCLEnv.waitProcess, proc, resourceLimits, timeLimit)
+
+    async def check_output(self, args, timeLimit, env = None, lineHandler = None, captureLimit = None, resourceLimits = None):
+        deadline = time.monotonic() + timeLimit
+        (proc, stdout, transport) = await self.startProcess(args, env, resourceLimits)
+        output = capturedOutput.CapturedOutput(captureLimit) if captureLimit is not None else bytearray()
+        lineSplitter = openCLTest.LineSplitter(self.openCLEnv.maxLineLength)
+
+        async def communicate():
+            while True:
+                chunk = await stdout.read(1 << 16)
+
+                if not chunk:
+                    lines = lineSplitter.finish()
+                else:
+                    output.write(chunk) if captureLimit is not None else output.extend(chunk)
+                    lines = lineSplitter.feed(chunk)
+
+                # Stop the process as soon as its output disqualifies the kernel
+                if lineHandler is not None and any(lineHandler(line) for line in lines):
+                    self.openCLEnv.killProcess(proc)
+                    break
+
+                if not chunk:
+                    break
+
+        try:
+            await asyncio.wait_for(communicate(), timeLimit)
+            usage = await self.waitProcess(proc, resourceLimits, max(deadline - time.monotonic(), 0))
+        except (asyncio.TimeoutError, subprocess.TimeoutExpired, asyncio.CancelledError) as err:
+            self.openCLEnv.killProcess(proc)
+            await self.waitProcess(proc)
+
+            if captureLimit is not None:
+                output.close()
+
+            if isinstance(err, asyncio.CancelledError):
+                raise
+
+            return None
+        finally:
+            if transport is not None:
+                transport.close()
+
+        if captureLimit is not None:
+            return (output, proc.returncode, usage)
+
+        return (output.decode(errors='replace').replace('\r\n', '\n'), proc.returncode, usage)
+
+    async def runClangCL(self, args, timeLimit, lineHandler = None, syntaxOnly = False):
+        # Building the header blocks, but only once per configuration
+        precompiledHeader = await asyncio.to_thread(self.openCLEnv.getPrecompiledHeader)
+
+        if precompiledHeader:
+            invocation = await self.check_output(self.openCLEnv.getClangCLCommand(args, syntaxOnly, precompiledHeader), timeLimit, lineHandler=lineHandler, resourceLimits=self.openCLEnv.resourceLimits)
+
+            if not self.openCLEnv.isRejectedPrecompiledHeader(invocation):
+                return invocation
+
+            try:
+                os.remove(precompiledHeader)
+            except OSError:
+                pass
+
+        return await self.check_output(self.openCLEnv.getClangCLCommand(args, syntaxOnly), timeLimit, lineHandler=lineHandler, resourceLimits=self.openCLEnv.resourceLimits)
+
+    async def runClangStaticAnalyzer(self, args, timeLimit, lineHandler = None):
+        return await self.runClangCL(self.openCLEnv.clangAnalyzerArgs + args, timeLimit, lineHandler)
+
+    async def runOclgrindClLauncher(self, kernel, timeLimit, optimised = True, lineHandler = None):
+        command = self.openCLEnv.getOclgrindCommand(kernel, optimised)
+
+        if command is None:
+            return None
+
+        (args, env) = command
+
+        # Oclgrind emulates the device on the CPU, only the paired runs of one test are limited by oclgrindConcurrency
+        return await self.check_output(args, timeLimit, env=env, lineHandler=lineHandler, captureLimit=self.openCLEnv.captureLimit, resourceLimits=self.openCLEnv.resourceLimits)
+
+    async def acquire(self, tryAcquire):
+        # File locks cannot be awaited, hence they are polled
+        while True:
+            result = tryAcquire()
+
+            if result is not None:
+                return result
+
+            await asyncio.sleep(self.pollInterval)
+
+    async def runKernel(self, platform, device, kernel, timeLimit, optimised = True, lineHandler = None):
+        devicePool = self.openCLEnv.devicePool
+
+        if devicePool is not None:
+            (device, lease) = await self.acquire(devicePool.tryAcquire)
+
+            try:
+                return await self.runKernelOnDevice(device[0], device[1], kernel, timeLimit, optimised, lineHandler)
+            finally:
+                devicePool.release(device, lease)
+
+        async with self.getSemaphore((str(platform), str(device)), self.openCLEnv.deviceConcurrency):
+            lease = self.openCLEnv.leaseDevice(platform, device)
+
+            if hasattr(lease, 'tryAcquire'):
+                await self.acquire(lease.tryAcquire)
+
+            try:
+                return await self.runKernelOnDevice(platform, device, kernel, timeLimit, optimised, lineHandler)
+            finally:
+                if hasattr(lease, 'release'):
+                    lease.release()
+
+    async def runKernelOnDevice(self, platform, device, kernel, timeLimit, optimised = True, lineHandler = None):
+        return await self.check_output(self.openCLEnv.getKernelCommand(platform, device, kernel, optimised), timeLimit, lineHandler=lineHandler, captureLimit=self.openCLEnv.captureLimit)
+
+class AsyncInterestingnessTest(openCLTest.InterestingnessTest):
+    async def runClang(self):
+        self.logProgress('Clang CL')
+        return await self.openCLEnv.runClangCL([self.kernelName], self.getTimeLimit('clang'), self.getLineHandler('clang'))
+
+    async def runClangSyntax(self):
+        self.logProgress('Clang CL syntax')
+        return await self.openCLEnv.runClangCL([self.kernelName], self.getTimeLimit('clang-syntax'), self.getLineHandler('clang-syntax'), syntaxOnly = True)
+
+    async def runClangAnalyzer(self):
+        self.logProgress('Clang Static Analyzer')
+        return await self.openCLEnv.runClangStaticAnalyzer([self.kernelName], self.getTimeLimit('clang-analyzer'), self.getLineHandler('clang-analyzer'))
+
+    async def runOclgrindOptimised(self):
+        self.logProgress('Run Oclgrind optimised')
+        return await self.openCLEnv.runOclgrindClLauncher(self.kernelName, self.getTimeLimit('oclgrind-optimised'), optimised = True, lineHandler = self.getLineHandler('oclgrind-optimised'))
+
+    async def runOclgrindUnoptimised(self):
+        self.logProgress('Run Oclgrind unoptimised')
+        return await self.openCLEnv.runOclgrindClLauncher(self.kernelName, self.getTimeLimit('oclgrind-unoptimised'), optimised = False, lineHandler = self.getLineHandler('oclgrind-unoptimised'))
+
+    async def runOclgrindSmall(self, stage, optimised):
+        smallKernelName = self.writeSingleWorkGroupKernel()
+
+        try:
+            return await self.openCLEnv.runOclgrindClLauncher(smallKernelName, self.getTimeLimit(stage), optimised = optimised, lineHandler = self.getLineHandler(stage))
+        finally:
+            os.remove(smallKernelName)
+
+    async def runOclgrindSmallOptimised(self):
+        self.logProgress('Run Oclgrind single work-group optimised')
+        return await self.runOclgrindSmall('oclgrind-small-optimised', True)
+
+    async def runOclgrindSmallUnoptimised(self):
+        self.logProgress('Run Oclgrind single work-group unoptimised')
+        return await self.runOclgrindSmall('oclgrind-small-unoptimised', False)
+
+    async def runKernelOptimised(self):
+        self.logProgress('Run optimised')
+        invocation = await self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, self.getTimeLimit('kernel-optimised'))
+
+        if invocation:
+            self.logProgress('Optimised result: ' + str(invocation[0]))
+
+        return invocation
+
+    async def runKernelUnoptimised(self):
+        self.logProgress('Run unoptimised')
+        invocation = await self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, self.getTimeLimit('kernel-unoptimised'), optimised = False)
+
+        if invocation:
+            self.logProgress('Unoptimised result: ' + str(invocation[0]))
+
+        return invocation
+
+    async def getStage(self, stage):
+        if stage in self.stageOutputs:
+            return self.stageOutputs[stage]
+
+        (method, dependencies, concurrency) = self.stageGraph[stage]
+        dependencyOutputs = await self.evaluateDependencies(dependencies, getattr(self.openCLEnv, concurrency) if concurrency else 1)
+
+        startTime = time.monotonic()
+
+        # Tool stages are coroutines, all other stages are evaluated directly
+        output = getattr(self, method)(*dependencyOutputs)
+
+        if asyncio.iscoroutine(output):
+            output = await output
+
+        if self.timings is not None and self.timings.calibrating and stage in self.toolStages:
+            self.timings.record(stage, time.monotonic() - startTime)
+
+        # Cancelled tasks never get here
+        if output is None and stage in self.toolStages:
+            self.incompleteStages.add(stage)
+
+        self.logUsage(stage, output)
+
+        self.stageOutputs[stage] = output
+        return output
+
+    async def evaluateDependencies(self, dependencies, concurrency):
+        pendingDependencies = [dependency for dependency in dependencies if dependency not in self.stageOutputs]
+
+        # Independent tool invocations run side by side, the first failure cancels the other one
+        if concurrency >= 2 and len(pendingDependencies) == 2:
+            tasks = [asyncio.ensure_future(self.getStage(dependency)) for dependency in pendingDependencies]
+
+            for task in asyncio.as_completed(tasks):
+                if not self.isSuccessfulOutput(await task):
+                    for pendingTask in tasks:
+                        pendingTask.cancel()
+
+                    break
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            for dependency in pendingDependencies:
+                self.stageOutputs.setdefault(dependency, None)
+
+        dependencyOutputs = [None] * len(dependencies)
+
+        for (index, dependency) in enumerate(dependencies):
+            dependencyOutputs[index] = await self.getStage(dependency)
+
+            if not self.isSuccessfulOutput(dependencyOutputs[index]):
+                break
+
+        return dependencyOutputs
+
+    async def getDivergentWorkItems(self):
+        with open(self.kernelName, 'r') as f:
+            kernelContent = f.read()
+
+        if kernelContent != self.kernelContent:
+            self.kernelContent = kernelContent
+            self.discardStageOutputs()
+
+        return await self.getStage('kernel-divergence')
+
+    async def runTest(self):
+        # The kernel might have been rewritten since the test was created
+        with open(self.kernelName, 'r') as f:
+            self.kernelContent = f.read()
+
+        if self.cache is None or (self.timings is not None and self.timings.calibrating):
+            return await self.evaluateTest()
+
+        configuration = self.openCLEnv.getConfiguration() + [diagnosticRules.getDiagnosticRulesDigest()]
+
+        if self.timings is not None:
+            configuration = configuration + [self.timings.getConfiguration()]
+
+        key = self.cache.getKey(self.kernelContent, self.test, self.testPlatform, self.testDevice, configuration)
+        verdict = self.cache.get(key)
+
+        if verdict is not None:
+            self.logProgress('Cached verdict')
+            return verdict
+
+        verdict = await self.evaluateTest()
+
+        if self.incompleteStages:
+            self.logProgress('Verdict not cached')
+        else:
+            self.cache.put(key, verdict)
+
+        return verdict
+
+    async def evaluateTest(self):
+        self.discardStageOutputs()
+        self.incompleteStages = set()
+
+        if self.test == 'oclgrind-uninitialized':
+            print('Deprecated!', file=sys.stderr)
+            return False
+
+        testStages = self.getTestStages()
+
+        if testStages is None:
+            return False
+
+        for stage in testStages:
+            expectSuccess = not stage.startswith('!')
+
+            if await self.getStage(stage.lstrip('!')) is not expectSuccess:
+                return False
+
+        return True
+
+async def runTests(test, openCLEnv, kernelNames, testPlatform, testDevice, cache = None):
+    asyncOpenCLEnv = AsyncOpenCLEnv(openCLEnv)
+    kernelTests = [AsyncInterestingnessTest(test, asyncOpenCLEnv, kernelName, testPlatform, testDevice, cache=cache) for kernelName in kernelNames]
+
+    return await asyncio.gather(*[kernelTest.runTest() for kernelTest in kernelTests])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate interestingness tests for many OpenCL kernels concurrently.')
+    parser.add_argument('--test', choices=openCLTest.InterestingnessTest.availableTests, default=openCLTest.InterestingnessTest.availableTests[0], help='Interestingness test')
+    parser.add_argument('kernels', nargs='+', help='Filenames of the OpenCL kernels')
+
+    args = parser.parse_args()
+
+    (openCLEnv, testPlatform, testDevice) = openCLTest.getTestEnvironment()
+    cache = verdictCache.getVerdictCache()
+
+    results = asyncio.run(runTests(args.test, openCLEnv, args.kernels, testPlatform, testDevice, cache))
+
+    for (kernelName, result) in zip(args.kernels, results):
+        print('%s %s' % (kernelName, 'interesting' if result else 'not interesting'))
+
+    if cache:
+        cache.close()
+
+    sys.exit(0 if all(results) else 1)
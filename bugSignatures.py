@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import os, re, json, time, argparse, hashlib, sqlite3, threading
+import openCLTest
+
+diagnosticRegex = re.compile(r'(?:error|warning): (.*)')
+quotedRegex = re.compile(r"'[^']*'|\"[^\"]*\"")
+numberRegex = re.compile(r'\b(?:0x[0-9a-fA-F]+|[0-9]+)\b')
+
+def normaliseDiagnostic(message):
+    # Identifiers, types and numbers differ between kernels which hit the same bug
+    return numberRegex.sub('N', quotedRegex.sub("'X'", message)).strip()
+
+def getDiagnosticPattern(invocation):
+    if invocation is None:
+        return ['timeout']
+
+    output = str(invocation[0])
+    messages = sorted(set(normaliseDiagnostic(m.group(1)) for m in diagnosticRegex.finditer(output)))
+
+    return [invocation[1] != 0] + messages
+
+def getDivergencePattern(divergentWorkItems, kernelContent):
+    kernelScan = openCLTest.scanKernel(kernelContent)
+
+    if not divergentWorkItems or kernelScan.globalDimensions is None:
+        return ['no-divergence']
+
+    workItemCount = kernelScan.getWorkItemCount()
+    localDimensions = kernelScan.localDimensions
+
+    # Position of the divergent work-items inside their work-group
+    localIds = set()
+
+    for linearId in divergentWorkItems:
+        coordinates = openCLTest.getWorkItemCoordinates(linearId, kernelScan.globalDimensions)
+        localCoordinates = [coordinate % size for (coordinate, size) in zip(coordinates, localDimensions)]
+        localIds.add(localCoordinates[0] + localDimensions[0] * (localCoordinates[1] + localDimensions[1] * localCoordinates[2]))
+
+    if len(divergentWorkItems) >= workItemCount:
+        share = 'all'
+    elif len(divergentWorkItems) == 1:
+        share = 'single'
+    elif 2 * len(divergentWorkItems) >= workItemCount:
+        share = 'most'
+    else:
+        share = 'some'
+
+    localSize = localDimensions[0] * localDimensions[1] * localDimensions[2]
+
+    if len(localIds) >= localSize:
+        localPattern = 'whole-group'
+    elif len(localIds) > 8:
+        localPattern = 'many'
+    else:
+        localPattern = sorted(localIds)
+
+    return ['divergence', share, localPattern]
+
+def getSignature(kernelTest):
+    # Cheap description of the bug, the stages have been evaluated by the interestingness test already
+    test = kernelTest.test
+
+    if test in ['miscompilation', 'wrong-code']:
+        pattern = getDivergencePattern(kernelTest.getDivergentWorkItems(), kernelTest.kernelContent)
+    elif test == 'oclgrind-miscompilation':
+        optimisedInvocation = kernelTest.getStage('oclgrind-optimised')
+        unoptimisedInvocation = kernelTest.getStage('oclgrind-unoptimised')
+
+        if optimisedInvocation is None or unoptimisedInvocation is None:
+            return None
+
+        pattern = getDivergencePattern(openCLTest.getDivergentWorkItems(optimisedInvocation[0], unoptimisedInvocation[0], kernelTest.divergenceLimit), kernelTest.kernelContent)
+    elif test == 'crash-unoptimised':
+        unoptimisedInvocation = kernelTest.getStage('kernel-unoptimised')
+        pattern = ['crash', unoptimisedInvocation[1] if unoptimisedInvocation is not None else 'timeout']
+    elif test == 'error-vector':
+        pattern = getDiagnosticPattern(kernelTest.getStage('clang'))
+    elif test == 'csa-invalid':
+        pattern = getDiagnosticPattern(kernelTest.getStage('clang-analyzer'))
+    elif test == 'oclgrind-optimised':
+        pattern = getDiagnosticPattern(kernelTest.getStage('oclgrind-optimised'))
+    else:
+        return None
+
+    return test + ':' + hashlib.sha256(json.dumps(pattern).encode()).hexdigest()[:16]
+
+class SignatureIndex:
+    def __init__(self, fileName):
+        self.fileName = os.path.abspath(fileName)
+        self.local = threading.local()
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection = sqlite3.connect(self.fileName, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS kernels (id INTEGER PRIMARY KEY, signature TEXT NOT NULL, kernelHash TEXT NOT NULL, kernel TEXT NOT NULL, registered REAL NOT NULL, UNIQUE (signature, kernelHash))')
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    def register(self, signature, kernelHash, kernel):
+        # Returns the kernel which was registered first and the number of kernels registered before this one
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            connection.execute('INSERT OR IGNORE INTO kernels (signature, kernelHash, kernel, registered) VALUES (?, ?, ?, ?)', (signature, kernelHash, kernel, time.time()))
+            kernelId = connection.execute('SELECT id FROM kernels WHERE signature = ? AND kernelHash = ?', (signature, kernelHash)).fetchone()[0]
+            (firstKernel, count) = connection.execute('SELECT (SELECT kernel FROM kernels WHERE signature = ? ORDER BY id LIMIT 1), COUNT(*) FROM kernels WHERE signature = ? AND id < ?', (signature, signature, kernelId)).fetchone()
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+        return (firstKernel, count)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the bug signatures of a signature index.')
+    parser.add_argument('index', help='Signature index')
+
+    args = parser.parse_args()
+
+    signatureIndex = SignatureIndex(args.index)
+
+    # Signatures in the order in which they were found, with the number of kernels and the first kernel
+    for (signature, count, kernel) in signatureIndex.connect().execute('SELECT signature, COUNT(*), (SELECT kernel FROM kernels AS first WHERE first.signature = kernels.signature ORDER BY id LIMIT 1) FROM kernels GROUP BY signature ORDER BY MIN(id)'):
+        print('%s %d %s' % (signature, count, kernel))
+
+    signatureIndex.close()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import os, time, json, hashlib, sqlite3, threading
+
+class CheckpointStore:
+    def __init__(self, fileName):
+        self.fileName = os.path.abspath(fileName)
+        self.local = threading.local()
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            # Autocommit mode, every checkpoint is durable once the stage has finished
+            connection = sqlite3.connect(self.fileName, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS checkpoints (kernel TEXT NOT NULL, stage TEXT NOT NULL, inputHash TEXT NOT NULL, outputHash TEXT, result INTEGER NOT NULL, data TEXT, finished REAL NOT NULL, PRIMARY KEY (kernel, stage))')
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    def get(self, kernel, stage):
+        row = self.connect().execute('SELECT inputHash, outputHash, result, data FROM checkpoints WHERE kernel = ? AND stage = ?', (kernel, stage)).fetchone()
+
+        if row is None:
+            return None
+
+        return (row[0], row[1], bool(row[2]), row[3])
+
+    def put(self, kernel, stage, inputHash, outputHash, result, data = None):
+        self.connect().execute('INSERT OR REPLACE INTO checkpoints (kernel, stage, inputHash, outputHash, result, data, finished) VALUES (?, ?, ?, ?, ?, ?, ?)', (kernel, stage, inputHash, outputHash, int(result), data, time.time()))
+
+def getFileHash(fileName):
+    if not os.path.exists(fileName):
+        return None
+
+    fileHash = hashlib.sha256()
+
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            fileHash.update(chunk)
+
+    return fileHash.hexdigest()
+
+def getInputHash(configuration, previousHash):
+    # A stage is identified by its configuration and the kernel which the previous stage left behind
+    return hashlib.sha256(json.dumps([configuration, previousHash]).encode()).hexdigest()
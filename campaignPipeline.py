@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import sys, threading, queue, traceback
+
+class Pipeline:
+    def __init__(self, queueSize = 16):
+        self.queueSize = max(queueSize, 1)
+        self.stages = []
+
+    def addStage(self, name, function, workers = 1):
+        self.stages.append((name, function, max(workers, 1)))
+
+    def runStage(self, stageIndex, queues, finished, remainingWorkers, lock):
+        (name, function, _) = self.stages[stageIndex]
+
+        while True:
+            job = queues[stageIndex].get()
+
+            if job is None:
+                with lock:
+                    remainingWorkers[stageIndex] -= 1
+                    lastWorker = (remainingWorkers[stageIndex] == 0)
+
+                # The last worker of a stage passes the end of the input on
+                if lastWorker and stageIndex + 1 < len(self.stages):
+                    for _ in range(self.stages[stageIndex + 1][2]):
+                        queues[stageIndex + 1].put(None)
+
+                return
+
+            (index, item) = job
+
+            try:
+                proceed = function(item)
+            except Exception:
+                print('Stage %s failed:' % name, file=sys.stderr)
+                traceback.print_exc()
+                proceed = False
+
+            if proceed and stageIndex + 1 < len(self.stages):
+                queues[stageIndex + 1].put(job)
+            else:
+                finished.put(job)
+
+    def feed(self, items, queues, finished):
+        count = 0
+
+        try:
+            for item in items:
+                if queues:
+                    queues[0].put((count, item))
+                else:
+                    finished.put((count, item))
+
+                count += 1
+        except Exception:
+            print('Reading the input failed:', file=sys.stderr)
+            traceback.print_exc()
+        finally:
+            # The items read so far are still processed, otherwise run() would wait forever
+            if queues:
+                for _ in range(self.stages[0][2]):
+                    queues[0].put(None)
+
+            finished.put((None, count))
+
+    def run(self, items, finish):
+        # Bounded queues keep the faster stages from running too far ahead
+        queues = [queue.Queue(self.queueSize) for _ in self.stages]
+        finished = queue.Queue()
+        remainingWorkers = [workers for (_, _, workers) in self.stages]
+        lock = threading.Lock()
+        threads = [threading.Thread(target=self.feed, args=(items, queues, finished), daemon=True)]
+
+        for stageIndex in range(len(self.stages)):
+            for _ in range(self.stages[stageIndex][2]):
+                threads.append(threading.Thread(target=self.runStage, args=(stageIndex, queues, finished, remainingWorkers, lock), daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        # Items are finished in input order, independent of the order in which they complete
+        pending = {}
+        nextIndex = 0
+        count = None
+
+        while count is None or nextIndex < count:
+            (index, item) = finished.get()
+
+            if index is None:
+                count = item
+                continue
+
+            pending[index] = item
+
+            while nextIndex in pending:
+                finish(pending.pop(nextIndex))
+                nextIndex += 1
+
+        for thread in threads:
+            thread.join()
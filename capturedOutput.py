@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import hashlib, tempfile
+
+class CapturedOutput:
+    def __init__(self, memoryLimit = 1 << 20):
+        self.memoryLimit = memoryLimit
+        self.hash = hashlib.sha256()
+        self.prefix = bytearray()
+        self.size = 0
+        self.spillFile = None
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+
+        # Only a bounded prefix is kept in memory, the rest goes to a temporary file
+        if self.spillFile is None and len(self.prefix) + len(data) <= self.memoryLimit:
+            self.prefix.extend(data)
+            return
+
+        if self.spillFile is None:
+            self.spillFile = tempfile.TemporaryFile(prefix='output.')
+
+            free = self.memoryLimit - len(self.prefix)
+            self.prefix.extend(data[:free])
+            data = data[free:]
+
+        self.spillFile.seek(0, 2)
+        self.spillFile.write(data)
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+
+    def getDigest(self):
+        return self.hash.hexdigest()
+
+    def isTruncated(self):
+        return self.spillFile is not None
+
+    def __eq__(self, other):
+        if not isinstance(other, CapturedOutput):
+            return NotImplemented
+
+        return self.size == other.size and self.getDigest() == other.getDigest()
+
+    def __hash__(self):
+        return hash(self.getDigest())
+
+    def __str__(self):
+        text = self.prefix.decode(errors='replace')
+
+        if self.isTruncated():
+            text += '\n[%d more bytes]' % (self.size - len(self.prefix))
+
+        return text
+
+    def read(self, offset, length):
+        data = bytes(self.prefix[offset:offset + length])
+
+        if self.spillFile is not None and len(data) < length:
+            self.spillFile.seek(max(offset - len(self.prefix), 0))
+            data += self.spillFile.read(length - len(data))
+
+        return data
+
+    def iterChunks(self, offset = 0, chunkSize = 1 << 16):
+        while offset < self.size:
+            chunk = self.read(offset, chunkSize)
+
+            if not chunk:
+                break
+
+            yield chunk
+            offset += len(chunk)
+
+    def getLastLineOffset(self, chunkSize = 1 << 16):
+        # Scan backwards, trailing whitespace does not start a new line
+        end = self.size
+        seenContent = False
+
+        while end > 0:
+            start = max(end - chunkSize, 0)
+            chunk = self.read(start, end - start)
+            end = start
+
+            if not seenContent:
+                chunk = chunk.rstrip()
+
+                if not chunk:
+                    continue
+
+                seenContent = True
+
+            index = chunk.rfind(b'\n')
+
+            if index >= 0:
+                return start + index + 1
+
+        return 0
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import os, sys, time, tempfile, threading, contextlib
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+def tryLock(fd):
+    try:
+        if sys.platform == 'win32':
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+
+    return True
+
+def unlock(fd):
+    if sys.platform == 'win32':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+class DeviceLease:
+    def __init__(self, lockDir, key, slots = 1, pollInterval = 0.05):
+        self.lockDir = lockDir
+        self.key = key
+        self.slots = max(slots, 1)
+        self.pollInterval = pollInterval
+        self.fd = None
+
+    def getLockFileName(self, slot):
+        return os.path.join(self.lockDir, '%s.%d.lock' % ('.'.join(str(part) for part in self.key), slot))
+
+    def tryAcquire(self):
+        os.makedirs(self.lockDir, exist_ok=True)
+
+        # Start at a different slot in every process to spread the lock attempts
+        firstSlot = os.getpid() % self.slots
+
+        for offset in range(self.slots):
+            slot = (firstSlot + offset) % self.slots
+            fd = os.open(self.getLockFileName(slot), os.O_RDWR | os.O_CREAT, 0o666)
+
+            if tryLock(fd):
+                self.fd = fd
+                return slot
+
+            os.close(fd)
+
+        return None
+
+    def acquire(self):
+        while True:
+            slot = self.tryAcquire()
+
+            if slot is not None:
+                return slot
+
+            time.sleep(self.pollInterval)
+
+    def release(self):
+        if self.fd is not None:
+            unlock(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
+
+class DevicePool:
+    def __init__(self, devices, slots = 1, lockDir = None, pollInterval = 0.05):
+        self.devices = devices
+        self.slots = max(slots, 1)
+        self.lockDir = lockDir
+        self.pollInterval = pollInterval
+        self.load = {device: 0 for device in devices}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes start with their own load, the lock files are shared anyway
+        state = self.__dict__.copy()
+        del state['lock']
+        state['load'] = {device: 0 for device in self.devices}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def tryAcquire(self):
+        with self.lock:
+            # Least loaded device first, ties are broken by the order of the pool
+            for device in sorted(self.devices, key=lambda device: self.load[device]):
+                if self.load[device] >= self.slots:
+                    continue
+
+                lease = None
+
+                if self.lockDir is not None:
+                    lease = DeviceLease(self.lockDir, ('device',) + device, self.slots)
+
+                    # Busy in another process
+                    if lease.tryAcquire() is None:
+                        continue
+
+                self.load[device] += 1
+                return (device, lease)
+
+        return None
+
+    def acquire(self):
+        while True:
+            deviceLease = self.tryAcquire()
+
+            if deviceLease is not None:
+                return deviceLease
+
+            time.sleep(self.pollInterval)
+
+    def release(self, device, lease):
+        if lease is not None:
+            lease.release()
+
+        with self.lock:
+            self.load[device] -= 1
+
+    @contextlib.contextmanager
+    def lease(self):
+        (device, lease) = self.acquire()
+
+        try:
+            yield device
+        finally:
+            self.release(device, lease)
+
+def parseDevices(devices):
+    # Comma separated list of platform:device pairs
+    return [tuple(device.strip().split(':', 1)) for device in devices.split(',') if device.strip()]
+
+def getDefaultLockDir():
+    # Lock files of different users must not collide
+    if hasattr(os, 'getuid'):
+        return os.path.join(tempfile.gettempdir(), 'interestingness-tests-locks-%d' % os.getuid())
+
+    return os.path.join(tempfile.gettempdir(), 'interestingness-tests-locks')
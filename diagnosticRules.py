@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import os, re, json, hashlib
+
+class DiagnosticRules:
+    def __init__(self, rules):
+        self.names = [rule['name'] for rule in rules]
+
+        # All rules are combined into one expression to classify the output in a single pass
+        patterns = []
+
+        for (index, rule) in enumerate(rules):
+            pattern = rule['pattern'] if rule.get('regex') else re.escape(rule['pattern'])
+            patterns.append('(?P<rule%d>%s)' % (index, pattern))
+
+        self.regex = re.compile('|'.join(patterns)) if patterns else None
+
+    def match(self, output):
+        if self.regex is None:
+            return None
+
+        m = self.regex.search(output)
+
+        if m is None:
+            return None
+
+        return self.names[int(m.lastgroup[len('rule'):])]
+
+loadedRules = {}
+
+def loadDiagnosticRules():
+    rulesFile = os.environ.get('CREDUCE_TEST_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosticRules.json'))
+
+    if rulesFile not in loadedRules:
+        with open(rulesFile, 'rb') as f:
+            content = f.read()
+
+        config = json.loads(content.decode())
+        rules = {name: DiagnosticRules(toolRules) for (name, toolRules) in config.items()}
+        loadedRules[rulesFile] = (rules, hashlib.sha256(content).hexdigest())
+
+    return loadedRules[rulesFile]
+
+def getDiagnosticRules(tool):
+    return loadDiagnosticRules()[0].get(tool, DiagnosticRules([]))
+
+def getDiagnosticRulesDigest():
+    return loadDiagnosticRules()[1]
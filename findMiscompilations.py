@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
-import argparse, tempfile, os, sys, subprocess, shutil, fileinput, re, pathlib
+import argparse, tempfile, os, sys, subprocess, shutil, re, pathlib, time, io, json
 import openCLTest
 from openCLTest import *
-import reduceDimension
+import reduceDimension, reduceKernel
+import verdictCache, stageTimings, diagnosticRules, campaignPipeline, deviceLease, campaignCheckpoints, kernelCorpus, bugSignatures
 
 def which(cmd):
     if sys.platform == 'win32' and '.' not in cmd:
@@ -20,12 +21,431 @@ def which(cmd):
 
     return None
 
-def removePreprocessorComments(kernelName):
-    for line in fileinput.input(kernelName, inplace=True):
-        if re.match('^# \d+ "[^"]*"', line):
-            continue
+linemarkerRegex = re.compile('# \\d+ "[^"]*"')
+
+def preprocessKernel(openCLEnv, preprocessorArgs, kernelName, timeLimit):
+    # Linemarkers are dropped while the output streams in, the kernel is replaced only once it is complete
+    tmpKernelName = '_' + kernelName
+    deadline = time.monotonic() + timeLimit
+
+    with open(tmpKernelName, 'w') as f:
+        def writeLine(line):
+            if not linemarkerRegex.match(line):
+                f.write(line)
+
+            return False
+
+        # Own process group, the timeout also stops the cc1 process which holds the pipe open
+        proc = openCLEnv.startProcess(preprocessorArgs, None, stderr = subprocess.DEVNULL)
+
+        try:
+            openCLEnv.communicateLines(proc, timeLimit, writeLine, keepOutput = False)
+            openCLEnv.waitProcess(proc, None, max(deadline - time.monotonic(), 0))
+        except subprocess.SubprocessError:
+            openCLEnv.killProcess(proc)
+            proc.communicate()
+
+    if proc.returncode != 0:
+        os.remove(tmpKernelName)
+        return False
+
+    os.replace(tmpKernelName, kernelName)
+    return True
+
+class KernelJob:
+    def __init__(self, inputKernel, resuming = False, content = None, contentHash = None):
+        self.inputKernel = inputKernel
+        self.kernelFile = inputKernel
+        self.kernelName = os.path.basename(inputKernel)
+        # Kernels from a corpus are only written to the output directory during preparation
+        self.content = content
+        self.contentHash = contentHash
+        self.timings = None
+        self.completed = False
+        # Test of the check stage, its tool outputs are reused for the bug signature
+        self.kernelTest = None
+        # Bug signature and hash of the signed kernel, kept for the deferred pass and stored in the checkpoint
+        self.signature = None
+        self.signedHash = None
+        self.deferred = False
+        # Hash of the kernel as the previous stage left it
+        self.previousHash = None
+        self.resuming = resuming
+        # Progress is buffered to keep the output of concurrent kernels apart
+        self.output = io.StringIO()
+        self.output.write('\n' + self.kernelName + ' ')
+
+    def restart(self):
+        # Deferred kernels pass through the pipeline again, the completed stages are resumed
+        self.kernelFile = self.inputKernel
+        self.timings = None
+        self.deferred = False
+        self.previousHash = None
+        self.resuming = True
+        self.output = io.StringIO()
+        self.output.write('\n' + self.kernelName + ' ')
+
+        return self
+
+    def log(self, message):
+        print(message, end=' ', file=self.output)
+
+class Campaign:
+    def __init__(self, args, openCLEnv, testPlatform, testDevice, clang, clSmithPath, outputDir, timeLimit, cache = None, env = None, testServer = None, logFile = None, checkpoints = None, loggedKernels = None, signatures = None):
+        self.args = args
+        self.openCLEnv = openCLEnv
+        self.testPlatform = testPlatform
+        self.testDevice = testDevice
+        self.clang = clang
+        self.clSmithPath = clSmithPath
+        self.outputDir = outputDir
+        self.timeLimit = timeLimit
+        self.cache = cache
+        self.env = env
+        self.testServer = testServer
+        self.logFile = logFile
+        self.checkpoints = checkpoints
+        self.loggedKernels = loggedKernels or set()
+        self.signatures = signatures
+        self.deferring = (args.duplicates == 'defer')
+        self.deferredJobs = []
+
+    def generateKernel(self, job):
+        clSmithArgs = [os.path.join(self.clSmithPath, 'CLSmith')]
+
+        if self.args.modes:
+            clSmithArgs.extend(['--' + mode for mode in self.args.modes])
+
+        # CLSmith always writes CLProg.c, hence every run gets its own scratch directory
+        scratchDir = tempfile.mkdtemp(prefix='generate.', dir='.')
+
+        try:
+            invocation = self.openCLEnv.check_output(clSmithArgs, self.timeLimit, cwd=scratchDir)
+            generatedFile = os.path.join(scratchDir, 'CLProg.c')
+
+            if not isSuccessfulInvocation(invocation) or not os.path.exists(generatedFile):
+                job.log('-> aborted generation')
+                return False
+
+            # The scratch directory is on the same file system, the kernel appears atomically
+            os.replace(generatedFile, job.kernelFile)
+        finally:
+            shutil.rmtree(scratchDir, ignore_errors=True)
+
+        if self.args.verbose:
+            job.log('-> generated')
+
+        return True
+
+    def prepareKernel(self, job):
+        kernelName = job.kernelName
+
+        if job.content is not None:
+            with open(kernelName, 'wb') as f:
+                f.write(job.content)
+
+            job.kernelFile = os.path.abspath(kernelName)
+            job.content = None
+
+        kernelDir = os.path.dirname(job.kernelFile)
 
-        print(line, end='')
+        # Preprocess kernel if desired or copy original kernel
+        if self.args.preprocess:
+            if not preprocessKernel(self.openCLEnv, [self.clang, '-I', self.clSmithPath, '-E', '-CC', job.kernelFile], kernelName, self.timeLimit):
+                job.log('-> aborted preprocessing')
+                return False
+
+            job.kernelFile = kernelName
+
+            if self.args.verbose:
+                job.log('-> preprocessed')
+        else:
+            if not os.path.samefile(self.outputDir, kernelDir):
+                shutil.copy(job.kernelFile, kernelName)
+                job.kernelFile = kernelName
+
+        return True
+
+    def checkKernel(self, job):
+        # A cached verdict leaves no tool outputs behind, the signature would have to run the tools again
+        cache = self.cache if self.signatures is None else None
+        kernelTest = InterestingnessTest(self.args.test, self.openCLEnv, job.kernelFile, self.testPlatform, self.testDevice, progressFile=job.output, cache=cache)
+
+        if not kernelTest.runTest():
+            kernelTest.discardStageOutputs()
+            job.log('-> check failed')
+            return False
+
+        if self.args.verbose:
+            job.log('-> check succeeded')
+
+        if self.signatures is not None:
+            job.kernelTest = kernelTest
+        else:
+            kernelTest.discardStageOutputs()
+
+        return True
+
+    def signKernel(self, job):
+        # Only without the check, or if the campaign was interrupted after it, the tools run again
+        kernelTest = job.kernelTest or InterestingnessTest(self.args.test, self.openCLEnv, job.kernelFile, self.testPlatform, self.testDevice, progressFile=job.output)
+        job.kernelTest = None
+
+        job.signature = bugSignatures.getSignature(kernelTest)
+        job.signedHash = campaignCheckpoints.getFileHash(job.kernelFile)
+        kernelTest.discardStageOutputs()
+
+        if job.signature is not None and self.args.verbose:
+            job.log('-> signature ' + job.signature)
+
+        return True
+
+    def filterDuplicate(self, job):
+        if job.signature is None:
+            return True
+
+        # Registering the signed kernel is idempotent, resumed and deferred kernels get the same answer again even if they were reduced since
+        (firstKernel, count) = self.signatures.register(job.signature, job.signedHash, job.kernelName)
+
+        if count == 0:
+            return True
+
+        job.log('-> duplicate of ' + firstKernel)
+
+        if self.args.duplicates == 'skip':
+            return False
+        elif self.args.duplicates == 'defer' and self.deferring:
+            job.deferred = True
+            return False
+
+        return True
+
+    def calibrateKernel(self, job):
+        # Measure the stages on the original kernel
+        job.timings = stageTimings.getStageTimings(os.path.abspath(job.kernelFile + '.timings'))
+        job.timings.startCalibration()
+
+        kernelTest = InterestingnessTest(self.args.test, self.openCLEnv, job.kernelFile, self.testPlatform, self.testDevice, timings=job.timings)
+        kernelTest.runTest()
+
+        job.timings.finishCalibration(kernelTest.getWorkItemCount())
+
+        if self.args.verbose:
+            job.log('-> calibrated')
+
+        return True
+
+    def reduceKernelDimension(self, job):
+        kernelTest = InterestingnessTest(self.args.test, self.openCLEnv, job.kernelFile, self.testPlatform, self.testDevice, cache=self.cache, timings=job.timings)
+        dimReducer = reduceDimension.DimensionReducer(job.kernelFile, kernelTest, self.args.dimensionProbes)
+        result = dimReducer.reduce(self.args.reduceDimension == 2)
+
+        if self.args.verbose:
+            job.log('-> dimension reduced' if result else '-> dimension unchanged')
+
+        return True
+
+    def reduceKernelNatively(self, job):
+        kernelTest = InterestingnessTest(self.args.test, self.openCLEnv, job.kernelFile, self.testPlatform, self.testDevice, cache=self.cache, timings=job.timings)
+        reducer = reduceKernel.KernelReducer(job.kernelFile, kernelTest, self.args.n or 1)
+        result = reducer.reduce()
+
+        if self.args.verbose:
+            job.log('-> natively reduced' if result else '-> natively unchanged')
+
+        return True
+
+    def reduceKernel(self, job):
+        kernelFile = job.kernelFile
+        wrapperName = 'test_wrapper_' + os.path.splitext(job.kernelName)[0]
+
+        # Create test file
+        if sys.platform == 'win32':
+            testFileName = wrapperName + '.bat'
+            testFile = open(testFileName, 'w')
+            testFile.write(os.path.abspath(openCLTest.__file__) + ' --test ' + self.args.test + ' ' + kernelFile + '\r\n')
+            testFile.close()
+            os.chmod(testFileName, 0o744)
+        else:
+            if self.testServer:
+                testScript = os.path.join(os.path.dirname(os.path.abspath(openCLTest.__file__)), 'testClient.py')
+            else:
+                testScript = os.path.abspath(openCLTest.__file__)
+
+            testFileName = wrapperName + '.sh'
+            testFile = open(testFileName, 'w')
+            testFile.write('#!/bin/bash\n')
+            testFile.write(testScript + ' --test ' + self.args.test + ' ' + kernelFile + '\n')
+            testFile.close()
+            os.chmod(testFileName, 0o744)
+
+        if sys.platform == 'win32':
+            creduceArgs = ['perl', '--', which('creduce.pl')]
+        else:
+            creduceArgs = ['creduce']
+
+        if self.args.n:
+            creduceArgs.extend(['--n', str(self.args.n)])
+
+        if self.args.verbose:
+            creduceArgs.append('--debug')
+
+        creduceArgs.append('--timing')
+
+        creduceArgs.append(testFileName)
+        creduceArgs.append(kernelFile)
+
+        # Concurrent reductions must not share the environment
+        kernelEnv = dict(self.env)
+
+        if job.timings:
+            kernelEnv['CREDUCE_TEST_TIMINGS'] = job.timings.fileName
+        else:
+            kernelEnv.pop('CREDUCE_TEST_TIMINGS', None)
+
+        # The output of C-Reduce can be huge, it goes live to a log file per kernel
+        reduceLogName = os.path.splitext(job.kernelName)[0] + '.creduce.log'
+
+        with open(reduceLogName, 'w') as reduceLog:
+            returnCode = subprocess.call(creduceArgs, env=kernelEnv, stdout=reduceLog, stderr=subprocess.STDOUT)
+
+        if returnCode != 0:
+            job.log('-> reduction failed (%s)' % reduceLogName)
+        elif self.args.verbose:
+            job.log('-> reduced (%s)' % reduceLogName)
+
+        return True
+
+    def completeKernel(self, job):
+        job.completed = True
+        return True
+
+    def finishKernel(self, job):
+        if job.completed:
+            job.log('-> done')
+        elif job.deferred:
+            job.log('-> deferred')
+            self.deferredJobs.append(job)
+
+        print(job.output.getvalue(), end='', flush=True)
+
+        # Resumed kernels might have been logged before the interruption
+        if job.completed and self.logFile and job.kernelName not in self.loggedKernels:
+            self.logFile.write(job.kernelName + '\n')
+
+    def getStageConfiguration(self, name):
+        # Options which influence the outcome of a stage, changing them invalidates the checkpoint
+        if name == 'generate':
+            return [name, self.args.modes]
+        elif name == 'prepare':
+            return [name, self.args.preprocess]
+
+        # The remaining stages run the interestingness test, they depend on the tools, devices and time limits
+        timeouts = self.args.adaptiveTimeouts and [os.environ.get(variable) for variable in stageTimings.timingsVariables]
+        configuration = [name, self.args.test, self.testPlatform, self.testDevice, self.openCLEnv.getConfiguration(), diagnosticRules.getDiagnosticRulesDigest(), timeouts]
+
+        if name == 'reduce-dimension':
+            configuration.extend([self.args.reduceDimension, self.args.dimensionProbes])
+        elif name in ['native-reduce', 'reduce']:
+            configuration.append(self.args.n)
+
+        return configuration
+
+    def resumeStage(self, name, job, data):
+        # Restore what the stage left behind in the job, fail if its results are gone
+        if name == 'generate':
+            return os.path.exists(job.kernelFile)
+        elif name == 'prepare':
+            if not os.path.exists(job.kernelName):
+                return False
+
+            job.kernelFile = job.kernelName
+        elif name == 'calibrate':
+            if not os.path.exists(job.kernelFile + '.timings'):
+                return False
+
+            job.timings = stageTimings.getStageTimings(os.path.abspath(job.kernelFile + '.timings'))
+        elif name == 'signature':
+            (job.signature, job.signedHash) = json.loads(data)
+        elif name == 'complete':
+            job.completed = True
+
+        return True
+
+    def getStageData(self, name, job):
+        # Results of a stage which are not files in the output directory
+        if name == 'signature':
+            return json.dumps([job.signature, job.signedHash])
+
+        return None
+
+    def runCheckpointedStage(self, name, function, job):
+        if name == 'prepare' and not self.args.generate:
+            job.previousHash = job.contentHash or campaignCheckpoints.getFileHash(job.kernelFile)
+
+        inputHash = campaignCheckpoints.getInputHash(self.getStageConfiguration(name), job.previousHash)
+
+        # Completed stages are skipped up to the first one which did not finish
+        if job.resuming:
+            checkpoint = self.checkpoints.get(job.kernelName, name)
+
+            if checkpoint is not None and checkpoint[0] == inputHash and self.resumeStage(name, job, checkpoint[3]):
+                job.previousHash = checkpoint[1]
+
+                if not checkpoint[2]:
+                    job.log('-> %s failed before' % name)
+                elif self.args.verbose:
+                    job.log('-> %s resumed' % name)
+
+                return checkpoint[2]
+
+            job.resuming = False
+
+        result = function(job)
+
+        job.previousHash = campaignCheckpoints.getFileHash(job.kernelFile)
+        self.checkpoints.put(job.kernelName, name, inputHash, job.previousHash, result, self.getStageData(name, job))
+
+        return result
+
+    def addStage(self, pipeline, name, function, workers):
+        if self.checkpoints is None:
+            pipeline.addStage(name, function, workers)
+        else:
+            pipeline.addStage(name, lambda job: self.runCheckpointedStage(name, function, job), workers)
+
+    def getPipeline(self):
+        args = self.args
+        pipeline = campaignPipeline.Pipeline(args.queueSize)
+
+        if args.generate:
+            self.addStage(pipeline, 'generate', self.generateKernel, args.cpuWorkers)
+
+        self.addStage(pipeline, 'prepare', self.prepareKernel, args.cpuWorkers)
+
+        if args.check:
+            self.addStage(pipeline, 'check', self.checkKernel, args.deviceWorkers)
+
+        if self.signatures is not None:
+            self.addStage(pipeline, 'signature', self.signKernel, args.deviceWorkers)
+            # Not checkpointed, whether a duplicate is deferred depends on the pass
+            pipeline.addStage('duplicates', self.filterDuplicate, 1)
+
+        if args.adaptiveTimeouts and (args.reduceDimension == 1 or args.nativeReduce or args.reduce):
+            self.addStage(pipeline, 'calibrate', self.calibrateKernel, args.deviceWorkers)
+
+        if args.reduceDimension:
+            self.addStage(pipeline, 'reduce-dimension', self.reduceKernelDimension, args.deviceWorkers)
+
+        if args.nativeReduce:
+            self.addStage(pipeline, 'native-reduce', self.reduceKernelNatively, args.reduceWorkers)
+
+        if args.reduce:
+            self.addStage(pipeline, 'reduce', self.reduceKernel, args.reduceWorkers)
+
+        self.addStage(pipeline, 'complete', self.completeKernel, 1)
+
+        return pipeline
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Optionally generate, run and compare OpenCL kernels.')
@@ -33,7 +453,8 @@ if __name__ == '__main__':
     inputGroup.add_argument('--generate', type=int, metavar='NUM', help='Generate NUM kernels on the fly')
     inputGroup.add_argument('--kernel-dir', dest='kernelDir', help='OpenCL kernel directory')
     inputGroup.add_argument('--kernels', metavar='KERNEL', nargs='+', help='OpenCL kernels')
-    parser.add_argument('--exclude-file', dest='excludeFile', help='File containing a list of kernels that should be ignored')
+    inputGroup.add_argument('--corpus', help='Kernel corpus created with kernelCorpus.py')
+    parser.add_argument('--exclude-file', dest='excludeFile', help='File containing a list of kernels (names or content hashes) that should be ignored')
     parser.add_argument('-n', metavar='NUM', type=int, help='Number of parallel interestingness tests per kernel')
     processGroup = parser.add_mutually_exclusive_group()
     processGroup.add_argument('--preprocess', action='store_true', help='Preprocess kernels')
@@ -42,29 +463,57 @@ if __name__ == '__main__':
     reduceGroup = parser.add_mutually_exclusive_group()
     reduceGroup.add_argument('--reduce-dimension', dest='reduceDimension', action='store_const', const=1, help='Reduce dimensions of the kernels')
     reduceGroup.add_argument('--reduce-dimension-unchecked', dest='reduceDimension', action='store_const', const=2, help='Reduce dimensions of the kernels (unchecked)')
+    parser.add_argument('--dimension-probes', dest='dimensionProbes', type=int, metavar='NUM', default=1, help='Number of NDRanges which are tested in parallel during the dimension reduction (default: 1)')
+    parser.add_argument('--native-reduce', dest='nativeReduce', action='store_true', help='Reduce the kernels with the built-in delta debugging reducer (before C-Reduce if --reduce is given)')
     parser.add_argument('--reduce', action='store_true', help='Start reduction of the kernels')
+    parser.add_argument('--server', action='store_true', help='Serve the interestingness test from a long-running process during reductions')
+    parser.add_argument('--adaptive-timeouts', dest='adaptiveTimeouts', action='store_true', help='Derive the time limits during reductions from a calibration run on the original kernel')
     parser.add_argument('--test', action='store', choices=InterestingnessTest.availableTests, default='miscompiled', help='Criterion which the kernel has to fulfill')
     parser.add_argument('--modes', nargs='+', action='store', choices=['atomic_reductions', 'atomics', 'barriers', 'divergence', 'fake_divergence', 'group_divergence', 'inter_thread_comm', 'vectors'], help='CLsmith modes')
     parser.add_argument('--output', help='Output directory')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
     parser.add_argument('--log', help='Log completed kernels')
+    parser.add_argument('--signatures', help='Index of known bug signatures, can be shared between campaigns (default: signatures.sqlite in the output directory if --duplicates is given)')
+    parser.add_argument('--duplicates', choices=['reduce', 'defer', 'skip'], default='reduce', help='Handling of kernels whose bug signature is already known: reduce them anyway, reduce them after all other kernels or skip them (default: reduce)')
+    parser.add_argument('--resume', action='store_true', help='Skip the stages which have already been completed for a kernel in the output directory')
+    parser.add_argument('--devices', nargs='+', metavar='PLATFORM:DEVICE', help='Equivalent devices across which the kernel runs are distributed (default: CREDUCE_TEST_DEVICES)')
+    parser.add_argument('--cpu-workers', dest='cpuWorkers', type=int, metavar='NUM', default=os.cpu_count() or 1, help='Number of kernels generated or preprocessed in parallel (default: number of CPUs)')
+    parser.add_argument('--device-workers', dest='deviceWorkers', type=int, metavar='NUM', default=1, help='Number of kernels checked and dimension reduced in parallel (default: 1)')
+    parser.add_argument('--reduce-workers', dest='reduceWorkers', type=int, metavar='NUM', default=1, help='Number of kernels reduced in parallel (default: 1)')
+    parser.add_argument('--queue-size', dest='queueSize', type=int, metavar='NUM', default=4, help='Maximum number of kernels waiting between two stages (default: 4)')
 
     args = parser.parse_args()
     timeLimit = 300
 
+    if args.resume and not args.output:
+        print('Resuming requires an output directory!')
+        sys.exit(1)
+
+    # Opening a missing corpus would silently create an empty one
+    if args.corpus and not os.path.isfile(args.corpus):
+        print('Kernel corpus %s not found!' % args.corpus)
+        sys.exit(1)
+
+    clSmithPath = None
     if args.generate or args.preprocess or not args.preprocessed:
         clSmithPath = os.environ.get('CLSMITH_PATH')
         if not clSmithPath:
             print('CLSMITH_PATH not defined!')
             sys.exit(1)
 
-    if (args.check and args.test != 'valid') or args.reduceDimension == 1 or args.reduce:
-        testPlatform = os.environ.get('CREDUCE_TEST_PLATFORM')
+    if args.devices:
+        os.environ['CREDUCE_TEST_DEVICES'] = ','.join(args.devices)
+
+    if (args.check and args.test != 'valid') or args.reduceDimension == 1 or args.nativeReduce or args.reduce:
+        # The first device of a pool is the default device under test
+        devices = deviceLease.parseDevices(os.environ.get('CREDUCE_TEST_DEVICES', ''))
+
+        testPlatform = os.environ.get('CREDUCE_TEST_PLATFORM', devices[0][0] if devices else None)
         if not testPlatform:
             print('CREDUCE_TEST_PLATFORM not defined!')
             sys.exit(1)
 
-        testDevice = os.environ.get('CREDUCE_TEST_DEVICE')
+        testDevice = os.environ.get('CREDUCE_TEST_DEVICE', devices[0][1] if devices else None)
         if not testDevice:
             print('CREDUCE_TEST_DEVICE not defined!')
             sys.exit(1)
@@ -72,7 +521,7 @@ if __name__ == '__main__':
         testPlatform = None
         testDevice = None
 
-    if args.check or args.reduceDimension == 1 or args.reduce:
+    if args.check or args.reduceDimension == 1 or args.nativeReduce or args.reduce:
         clLauncher = os.environ.get('CREDUCE_TEST_CLLAUNCHER', os.path.abspath('./cl_launcher'))
         if not which(clLauncher):
             clLauncher = os.path.basename(clLauncher)
@@ -93,6 +542,7 @@ if __name__ == '__main__':
 
     libclcIncludePath = os.environ.get('CREDUCE_LIBCLC_INCLUDE_PATH')
 
+    env = None
     if args.reduce:
         env = os.environ
 
@@ -120,6 +570,10 @@ if __name__ == '__main__':
     else:
         openCLEnv = UnixOpenCLEnv(clLauncher, clang, libclcIncludePath)
 
+    configureOpenCLEnv(openCLEnv)
+
+    cache = verdictCache.getVerdictCache()
+
     origDir = os.getcwd()
 
     # Create output directory
@@ -132,16 +586,15 @@ if __name__ == '__main__':
         os.mkdir(outputDir)
 
     # Get exluded files
-    excludedFiles = [];
+    excludedFiles = set()
     if args.excludeFile and os.path.exists(args.excludeFile):
         with open(args.excludeFile, 'r') as f:
-            excludedFiles.extend(f.read().splitlines())
+            excludedFiles.update(f.read().splitlines())
 
     # Get kernel filenames
     if args.generate:
         inputKernels = [os.path.join(outputDir, 'CLProg_%d.cl' % i) for i in range(0, args.generate)]
         countKernels = args.generate
-        clSmithTool = os.path.join(clSmithPath, 'CLSmith')
     elif args.kernels:
         inputKernels = [os.path.join(origDir, inputKernel) for inputKernel in args.kernels if os.path.basename(inputKernel) not in excludedFiles]
         countKernels = len(inputKernels)
@@ -150,15 +603,60 @@ if __name__ == '__main__':
         p = pathlib.Path(kernelDir)
         inputKernels = [str(inputKernel) for inputKernel in p.glob('*.cl') if inputKernel.name not in excludedFiles]
         countKernels = len(inputKernels)
+    elif args.corpus:
+        corpus = kernelCorpus.KernelCorpus(os.path.join(origDir, args.corpus))
+        inputKernels = None
 
     # Sort kernels
-    alpha_num_key = lambda s : [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', s)]
-    inputKernels.sort(key=alpha_num_key)
+    if inputKernels is not None:
+        alpha_num_key = lambda s : [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', s)]
+        inputKernels.sort(key=alpha_num_key)
+
+    # Start interestingness test server
+    testServer = None
+    if args.reduce and args.server:
+        if sys.platform == 'win32':
+            print('Test server not supported on Windows!')
+            sys.exit(1)
+
+        socketName = os.path.join(tempfile.mkdtemp(prefix='test-server.'), 'test.sock')
+        env['CREDUCE_TEST_SOCKET'] = socketName
+        serverArgs = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(openCLTest.__file__)), 'testServer.py')]
+
+        # One worker per parallel C-Reduce test
+        if args.n:
+            serverArgs.extend(['--workers', str(args.n * args.reduceWorkers)])
+
+        # Logs of the server belong into the output directory like those of standalone tests
+        testServer = subprocess.Popen(serverArgs, env=env, cwd=outputDir)
+
+        while not os.path.exists(socketName) and testServer.poll() is None:
+            time.sleep(0.1)
+
+        if testServer.poll() is not None:
+            print('Test server could not be started!')
+            sys.exit(1)
 
     # Log completed kernels
+    logFile = None
+    loggedKernels = set()
     if args.log:
+        if args.resume and os.path.exists(args.log):
+            with open(args.log, 'r') as f:
+                loggedKernels.update(f.read().splitlines())
+
         logFile = open(os.path.abspath(args.log), 'a', 1)
 
+    # Stage outcomes of every kernel are recorded to resume interrupted campaigns
+    checkpoints = campaignCheckpoints.CheckpointStore(os.path.join(outputDir, 'checkpoints.sqlite'))
+
+    # Bug signatures of the interesting kernels
+    signatures = None
+    if args.signatures:
+        signatures = bugSignatures.SignatureIndex(os.path.join(origDir, args.signatures))
+    elif args.duplicates != 'reduce':
+        signatures = bugSignatures.SignatureIndex(os.path.join(outputDir, 'signatures.sqlite'))
+
     # Change to output directory
     os.chdir(outputDir)
 
@@ -168,115 +666,36 @@ if __name__ == '__main__':
         shutil.copy(os.path.join(clSmithPath, 'safe_math_macros.h'), '.')
         shutil.copy(os.path.join(clSmithPath, 'cl_safe_math_macros.h'), '.')
 
-    # Iterate over all kernels
-    for inputKernel in inputKernels:
-        kernelFile = inputKernel
-        kernelName = os.path.basename(kernelFile)
-        kernelDir = os.path.dirname(kernelFile)
-
-        print('')
-        print(kernelName, end=' ', flush=True)
-
-        # Generate kernel if desired
-        if args.generate:
-            try:
-                clSmithArgs = [clSmithTool]
-
-                if args.modes:
-                    clSmithArgs.extend(['--' + mode for mode in args.modes])
-
-                openCLEnv.check_output(clSmithArgs, timeLimit)
-            except subprocess.SubprocessError:
-                print('-> aborted generation')
-                continue
-
-            os.rename('CLProg.c', kernelFile)
-
-            if args.verbose:
-                print('-> generated', end=' ', flush=True)
-
-        # Preprocess kernel if desired or copy original kernel
-        if args.preprocess:
-            try:
-                openCLEnv.check_output([clang, '-I', clSmithPath, '-E', '-CC', '-o', '_' + kernelName, kernelFile], timeLimit)
-                removePreprocessorComments('_' + kernelName)
-                os.rename('_' + kernelName, kernelName)
-                kernelFile = kernelName
-
-                if args.verbose:
-                    print('-> preprocessed', end=' ', flush=True)
-            except subprocess.SubprocessError:
-                print('-> aborted preprocessing', end=' ', flush=True)
-                continue
-        else:
-            if not os.path.samefile(outputDir, kernelDir):
-                shutil.copy(kernelFile, kernelName)
-                kernelFile = kernelName
-
-        # Check if kernel is interesting
-        if args.check:
-            kernelTest = InterestingnessTest(args.test, openCLEnv, kernelFile, testPlatform, testDevice, progressFile=sys.stdout)
-            result = kernelTest.runTest()
-
-            if not result:
-                print('-> check failed', end=' ', flush=True)
-                continue
-            else:
-                if args.verbose:
-                    print('-> check succeeded', end=' ', flush=True)
-
-        # Reduce dimension of the kernel
-        if args.reduceDimension:
-            kernelTest = InterestingnessTest(args.test, openCLEnv, kernelFile, testPlatform, testDevice)
-            dimReducer = reduceDimension.DimensionReducer(kernelFile, kernelTest)
-            result = dimReducer.reduce(args.reduceDimension == 2)
-
-            if not result:
-                if args.verbose:
-                    print('-> dimension unchanged', end=' ', flush=True)
-            else:
-                if args.verbose:
-                    print('-> dimension reduced', end=' ', flush=True)
-
-        if args.reduce:
-            # Create test file
-            if sys.platform == 'win32':
-                testFileName = 'test_wrapper.bat'
-                testFile = open(testFileName, 'w')
-                testFile.write(os.path.abspath(openCLTest.__file__) + ' --test ' + args.test + ' ' + kernelFile + '\r\n')
-                testFile.close()
-                os.chmod(testFileName, 0o744)
-            else:
-                testFileName = 'test_wrapper.sh'
-                testFile = open(testFileName, 'w')
-                testFile.write('#!/bin/bash\n')
-                testFile.write(os.path.abspath(openCLTest.__file__) + ' --test ' + args.test + ' ' + kernelFile + '\n')
-                testFile.close()
-                os.chmod(testFileName, 0o744)
-
-            if sys.platform == 'win32':
-                creduceArgs = ['perl', '--', which('creduce.pl')]
-            else:
-                creduceArgs = ['creduce']
+    # Process the kernels in a pipeline of stages
+    campaign = Campaign(args, openCLEnv, testPlatform, testDevice, clang, clSmithPath, outputDir, timeLimit, cache, env, testServer, logFile, checkpoints, loggedKernels, signatures)
+    if inputKernels is not None:
+        jobs = (KernelJob(inputKernel, args.resume) for inputKernel in inputKernels)
+    else:
+        # The corpus is read while the pipeline is running, duplicates have been removed when it was built
+        jobs = (KernelJob(name, args.resume, content, contentHash) for (name, contentHash, content) in corpus.iterKernels() if name not in excludedFiles and contentHash not in excludedFiles)
 
-            if args.n:
-                creduceArgs.extend(['--n', str(args.n)])
+    pipeline = campaign.getPipeline()
+    pipeline.run(jobs, campaign.finishKernel)
 
-            if args.verbose:
-                creduceArgs.append('--debug')
+    # Duplicates of known bugs are reduced after all other kernels
+    if campaign.deferredJobs:
+        campaign.deferring = False
+        pipeline.run((job.restart() for job in campaign.deferredJobs), campaign.finishKernel)
 
-            creduceArgs.append('--timing')
+    os.chdir(origDir)
+    print('')
+    if logFile:
+        logFile.close()
 
-            creduceArgs.append(testFileName)
-            creduceArgs.append(kernelFile)
+    if testServer:
+        testServer.terminate()
+        testServer.wait()
+        os.rmdir(os.path.dirname(socketName))
 
-            subprocess.call(creduceArgs, env=env, universal_newlines=True)
+    checkpoints.close()
 
-        print('-> done', end=' ', flush=True)
-        if args.log and logFile:
-            logFile.write(kernelName + '\n')
+    if signatures:
+        signatures.close()
 
-    os.chdir(origDir)
-    print('')
-    if args.log and logFile:
-        logFile.close()
+    if cache:
+        cache.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os, argparse, hashlib, sqlite3, threading, zlib
+
+class KernelCorpus:
+    def __init__(self, fileName):
+        self.fileName = os.path.abspath(fileName)
+        self.local = threading.local()
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection = sqlite3.connect(self.fileName, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Kernels are unique by content, the name is only used for the files in the output directory
+            connection.execute('CREATE TABLE IF NOT EXISTS kernels (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, name TEXT NOT NULL UNIQUE, content BLOB NOT NULL)')
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(*) FROM kernels').fetchone()[0]
+
+    def addKernels(self, kernels, batchSize = 1000):
+        connection = self.connect()
+        added = 0
+
+        # One transaction per batch, otherwise every insert waits for the disk
+        batch = []
+
+        for (name, content) in kernels:
+            batch.append((name, content))
+
+            if len(batch) >= batchSize:
+                added += self.addBatch(connection, batch)
+                batch = []
+
+        if batch:
+            added += self.addBatch(connection, batch)
+
+        return added
+
+    def addBatch(self, connection, batch):
+        added = 0
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            for (name, content) in batch:
+                contentHash = hashlib.sha256(content).hexdigest()
+
+                if connection.execute('SELECT 1 FROM kernels WHERE hash = ?', (contentHash,)).fetchone():
+                    continue
+
+                # Different kernels with the same name are told apart by their hash, the full hash is unique
+                (stem, ext) = os.path.splitext(name)
+
+                for candidateName in [name, '%s_%s%s' % (stem, contentHash[:12], ext), '%s_%s%s' % (stem, contentHash, ext)]:
+                    if not connection.execute('SELECT 1 FROM kernels WHERE name = ?', (candidateName,)).fetchone():
+                        name = candidateName
+                        break
+
+                connection.execute('INSERT INTO kernels (hash, name, content) VALUES (?, ?, ?)', (contentHash, name, zlib.compress(content)))
+                added += 1
+
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+        return added
+
+    def iterKernels(self):
+        # Rows are fetched lazily, the corpus never has to fit into memory
+        for (name, contentHash, content) in self.connect().execute('SELECT name, hash, content FROM kernels ORDER BY id'):
+            yield (name, contentHash, zlib.decompress(content))
+
+def iterKernelFiles(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        # No listing of the whole directory and no sorting
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.cl') and entry.is_file():
+                    yield entry.path
+
+def readKernelFiles(fileNames):
+    for fileName in fileNames:
+        with open(fileName, 'rb') as f:
+            yield (os.path.basename(fileName), f.read())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage a deduplicated corpus of OpenCL kernels.')
+    parser.add_argument('corpus', help='Corpus file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    addParser = subparsers.add_parser('add', help='Add kernels, kernels which are already in the corpus are skipped')
+    addParser.add_argument('paths', nargs='+', help='OpenCL kernels or directories containing them')
+    subparsers.add_parser('list', help='List the kernels')
+    extractParser = subparsers.add_parser('extract', help='Write the kernels into a directory')
+    extractParser.add_argument('directory', help='Output directory')
+
+    args = parser.parse_args()
+
+    if args.command != 'add' and not os.path.isfile(args.corpus):
+        parser.error('Kernel corpus %s not found!' % args.corpus)
+
+    corpus = KernelCorpus(args.corpus)
+
+    if args.command == 'add':
+        added = corpus.addKernels(readKernelFiles(iterKernelFiles(args.paths)))
+        print('Added %d kernels, %d in corpus' % (added, len(corpus)))
+    elif args.command == 'list':
+        for (name, contentHash, _) in corpus.iterKernels():
+            print(contentHash, name)
+    elif args.command == 'extract':
+        os.makedirs(args.directory, exist_ok=True)
+
+        for (name, _, content) in corpus.iterKernels():
+            with open(os.path.join(args.directory, name), 'wb') as f:
+                f.write(content)
+
+    corpus.close()
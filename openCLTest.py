@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-import sys, os, re, subprocess, signal, argparse
+import sys, os, re, subprocess, signal, argparse, threading, time, hashlib, json, tempfile
+import itertools, contextlib
+import verdictCache, stageTimings, diagnosticRules, capturedOutput, deviceLease
 
 def which(cmd):
     if sys.platform == 'win32' and '.' not in cmd:
@@ -17,10 +19,330 @@ def which(cmd):
 
     return None
 
+def isSuccessfulInvocation(invocation):
+    return invocation is not None and invocation[1] == 0
+
+class Cancellation:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.processes = {}
+
+    def register(self, proc, killProcess):
+        with self.lock:
+            if self.cancelled:
+                killProcess(proc)
+            else:
+                self.processes[proc] = killProcess
+
+    def unregister(self, proc):
+        with self.lock:
+            self.processes.pop(proc, None)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+
+            for (proc, killProcess) in self.processes.items():
+                killProcess(proc)
+
+            self.processes.clear()
+
+    def isCancelled(self):
+        with self.lock:
+            return self.cancelled
+
+class AppendLog:
+    def __init__(self, fileName):
+        # Writes with O_APPEND are not interleaved with those of other processes
+        self.fd = os.open(fileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, text):
+        os.write(self.fd, text.encode())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+class ResourceUsage:
+    def __init__(self, cpuTime, maxRss, exitCause):
+        self.cpuTime = cpuTime
+        self.maxRss = maxRss
+        self.exitCause = exitCause
+
+    def __str__(self):
+        return '%.2fs CPU, %d MiB max RSS, %s' % (self.cpuTime, self.maxRss >> 20, self.exitCause)
+
+# Sets the resource limits and replaces itself with the tool if prlimit is not available
+resourceLimitShim = '''
+import os, sys, resource
+(memoryLimit, cpuLimit) = sys.argv[1:3]
+if memoryLimit:
+    resource.setrlimit(resource.RLIMIT_AS, (int(memoryLimit), int(memoryLimit)))
+if cpuLimit:
+    resource.setrlimit(resource.RLIMIT_CPU, (int(cpuLimit), int(cpuLimit) + 1))
+os.execvp(sys.argv[3], sys.argv[3:])
+'''
+
+def getLogFileName():
+    return os.environ.get('CREDUCE_TEST_LOG_FILE', 'output.log').replace('%p', str(os.getpid()))
+
+class LineSplitter:
+    def __init__(self, maxLineLength):
+        self.maxLineLength = maxLineLength
+        self.line = b''
+
+    def feed(self, chunk):
+        lines = (self.line + chunk).split(b'\n')
+        self.line = lines.pop()
+
+        # Diagnostics are short, overlong lines are not inspected
+        if len(self.line) > self.maxLineLength:
+            self.line = b''
+
+        return [line.decode(errors='replace') + '\n' for line in lines]
+
+    def finish(self):
+        line = self.line
+        self.line = b''
+
+        return [line.decode(errors='replace')] if line else []
+
+deviceSemaphores = {}
+deviceSemaphoresLock = threading.Lock()
+
+def getDeviceSemaphore(key, concurrency):
+    with deviceSemaphoresLock:
+        if key not in deviceSemaphores:
+            deviceSemaphores[key] = threading.BoundedSemaphore(max(concurrency, 1))
+
+        return deviceSemaphores[key]
+
+dimensionHeaderRegex = re.compile('//(.*) -g ([0-9]+),([0-9]+),([0-9]+) -l ([0-9]+),([0-9]+),([0-9]+)')
+kernelTokenRegex = re.compile(r'//[^\n]*|/\*.*?(?:\*/|\Z)|"(?:\\.|[^"\\\n])*"?|\'(?:\\.|[^\'\\\n])*\'?|^[ \t]*#(?:\\\n|[^\n])*|[A-Za-z_]\w*|[0-9]\w*|\S', re.M | re.S)
+linearIdTokens = ['return', '(', 'get_global_id', '(', '2', ')', '*', 'get_global_size', '(', '1', ')', '+', 'get_global_id', '(', '1', ')', ')', '*', 'get_global_size', '(', '0', ')', '+', 'get_global_id', '(', '0', ')', ';']
+resultAccessTokens = ['result', '[', 'get_linear_global_id', '(', ')', ']']
+closingBrackets = {')': '(', ']': '[', '}': '{'}
+
+class KernelScan:
+    def __init__(self, kernelContent):
+        self.metaInformation = None
+        self.globalDimensions = None
+        self.localDimensions = None
+        # None if brackets are opened or closed by macros, they can only be matched after preprocessing
+        self.isBalanced = True
+        self.hasValidResultAccess = False
+        self.hasLinearId = False
+
+        m = dimensionHeaderRegex.match(kernelContent)
+
+        if m:
+            self.metaInformation = m.group(1)
+            self.globalDimensions = (int(m.group(2)), int(m.group(3)), int(m.group(4)))
+            self.localDimensions = (int(m.group(5)), int(m.group(6)), int(m.group(7)))
+
+        tokens = []
+        brackets = []
+        bracketsBalanced = True
+        hasMacroBrackets = False
+
+        # Comments, literals and preprocessor directives are skipped
+        for m in kernelTokenRegex.finditer(kernelContent):
+            token = m.group(0)
+
+            if token.startswith('/*'):
+                if not token.endswith('*/') or len(token) < 4:
+                    self.isBalanced = False
+            elif token[0] in '"\'':
+                if len(token) < 2 or token[-1] != token[0]:
+                    self.isBalanced = False
+            elif token.lstrip().startswith('#'):
+                if sum(token.count(bracket) for bracket in '([{') != sum(token.count(bracket) for bracket in closingBrackets):
+                    hasMacroBrackets = True
+            elif not token.startswith('//'):
+                tokens.append(token)
+
+                if token in '([{':
+                    brackets.append(token)
+                elif token in closingBrackets:
+                    if not brackets or brackets.pop() != closingBrackets[token]:
+                        bracketsBalanced = False
+
+        if brackets:
+            bracketsBalanced = False
+
+        if not bracketsBalanced and self.isBalanced:
+            self.isBalanced = None if hasMacroBrackets else False
+
+        hasResultAccess = False
+
+        for (index, token) in enumerate(tokens):
+            # Access to result with get_linear_global_id(), if result is accessed at all
+            if token == 'result' and tokens[index + 1:index + 2] == ['[']:
+                hasResultAccess = True
+
+                if tokens[index:index + len(resultAccessTokens)] == resultAccessTokens:
+                    self.hasValidResultAccess = True
+            elif token == 'return' and tokens[index:index + len(linearIdTokens)] == linearIdTokens:
+                self.hasLinearId = True
+
+        if not hasResultAccess:
+            self.hasValidResultAccess = True
+
+    def getWorkItemCount(self):
+        if self.globalDimensions is None:
+            return None
+
+        return self.globalDimensions[0] * self.globalDimensions[1] * self.globalDimensions[2]
+
+def getResultValues(output):
+    # cl_launcher prints the result buffer as comma separated values, one per work-item, in the last line
+    if not isinstance(output, capturedOutput.CapturedOutput):
+        lines = output.strip().splitlines()
+
+        if lines:
+            yield from (value.strip() for value in lines[-1].rstrip(',').split(','))
+
+        return
+
+    # Captured outputs are streamed, the line can be larger than the memory limit
+    remainder = b''
+
+    for chunk in output.iterChunks(output.getLastLineOffset()):
+        values = (remainder + chunk).split(b',')
+        remainder = values.pop()
+
+        for value in values:
+            yield value.strip().decode(errors='replace')
+
+    remainder = remainder.strip()
+
+    if remainder:
+        yield remainder.decode(errors='replace')
+
+def getDivergentWorkItems(optimisedOutput, unoptimisedOutput, limit = None):
+    divergentWorkItems = []
+
+    # Missing values count as divergent too
+    for (index, (optimisedValue, unoptimisedValue)) in enumerate(itertools.zip_longest(getResultValues(optimisedOutput), getResultValues(unoptimisedOutput))):
+        if optimisedValue != unoptimisedValue:
+            divergentWorkItems.append(index)
+
+            if limit is not None and len(divergentWorkItems) >= limit:
+                break
+
+    return divergentWorkItems
+
+def getDimensionHeader(metaInformation, globalDimensions, localDimensions):
+    return '//%s -g %d,%d,%d -l %d,%d,%d\n' % ((metaInformation,) + tuple(globalDimensions) + tuple(localDimensions))
+
+def getSingleWorkGroupKernel(kernelContent):
+    # Same kernel with the NDRange shrunk to one work-group of the original local size
+    m = dimensionHeaderRegex.match(kernelContent)
+    localDimensions = (int(m.group(5)), int(m.group(6)), int(m.group(7)))
+
+    return getDimensionHeader(m.group(1), localDimensions, localDimensions) + kernelContent[m.end():].split('\n', 1)[-1]
+
+def getWorkItemCoordinates(linearId, globalDimensions):
+    # Inverse of get_linear_global_id()
+    return (linearId % globalDimensions[0], (linearId // globalDimensions[0]) % globalDimensions[1], linearId // (globalDimensions[0] * globalDimensions[1]))
+
+kernelScans = {}
+
+def scanKernel(kernelContent):
+    contentHash = hashlib.sha1(kernelContent.encode()).digest()
+
+    # Other threads may clear the table at any time
+    kernelScan = kernelScans.get(contentHash)
+
+    if kernelScan is None:
+        # Long running processes see many variants
+        if len(kernelScans) >= 1024:
+            kernelScans.clear()
+
+        kernelScan = KernelScan(kernelContent)
+        kernelScans[contentHash] = kernelScan
+
+    return kernelScan
+
 class InterestingnessTest:
     availableTests = ['miscompilation', 'crash-unoptimised', 'error-vector', 'statically-valid', 'valid', 'csa-invalid', 'oclgrind-miscompilation', 'oclgrind-optimised', 'oclgrind-uninitialized', 'wrong-code']
 
-    def __init__(self, test, openCLEnv, kernelName, testPlatform, testDevice, outputFile = None, progressFile = None):
+    # Stages which have to succeed for each test, stages prefixed with '!' have to fail
+    # Only tests which need a cl_launcher kernel reject unbalanced variants before running any tool
+    # Tests using statically-valid-tiered reject most kernels with a cheap -fsyntax-only run before the full compilation
+    testStages = {
+        'miscompilation': ['well-formed', 'cl-launcher-kernel', 'statically-valid-tiered', 'oclgrind-valid', 'miscompiled'],
+        'crash-unoptimised': ['well-formed', 'cl-launcher-kernel', 'statically-valid-tiered', 'oclgrind-valid', 'crash-unoptimised'],
+        'error-vector': ['well-formed', 'cl-launcher-kernel', 'clang-vector-error', 'kernel-optimised-valid'],
+        'statically-valid': ['statically-valid'],
+        'valid': ['well-formed', 'cl-launcher-kernel', 'statically-valid-tiered', 'oclgrind-valid'],
+        'csa-invalid': ['clang-valid', '!clang-analyzer-valid', 'oclgrind-unoptimised-completed'],
+        'oclgrind-miscompilation': ['well-formed', 'cl-launcher-kernel', 'statically-valid-tiered', 'oclgrind-valid', 'oclgrind-miscompiled'],
+        'oclgrind-optimised': ['!oclgrind-optimised-completed'],
+        'oclgrind-uninitialized': None,
+        'wrong-code': ['miscompiled'],
+    }
+
+    # Stage -> (method, dependencies, OpenCLEnv attribute limiting the concurrency of the dependencies)
+    # The outputs of the dependencies are passed to the method. As soon as one dependency fails the
+    # remaining ones are skipped and passed as None. Outputs are memoized during one test evaluation
+    # so every tool is invoked at most once per kernel.
+    stageGraph = {
+        'clang': ('runClang', [], None),
+        'clang-syntax': ('runClangSyntax', [], None),
+        'clang-analyzer': ('runClangAnalyzer', [], None),
+        'oclgrind-optimised': ('runOclgrindOptimised', [], None),
+        'oclgrind-unoptimised': ('runOclgrindUnoptimised', [], None),
+        'kernel-optimised': ('runKernelOptimised', [], None),
+        'kernel-unoptimised': ('runKernelUnoptimised', [], None),
+        'well-formed': ('isWellFormedKernel', [], None),
+        'cl-launcher-kernel': ('isValidCLLauncherKernel', [], None),
+        'clang-valid': ('isValidClang', ['clang'], None),
+        'clang-syntax-valid': ('isValidClang', ['clang-syntax'], None),
+        'clang-tiered-valid': ('isValidClangTiered', ['clang-syntax-valid', 'clang-valid'], None),
+        'clang-analyzer-valid': ('isValidClangAnalyzer', [], None),
+        'clang-vector-error': ('hasVectorError', ['clang'], None),
+        'statically-valid': ('isStaticallyValid', ['clang-valid', 'clang-analyzer-valid'], None),
+        'statically-valid-tiered': ('isStaticallyValid', ['clang-tiered-valid', 'clang-analyzer-valid'], None),
+        'oclgrind-valid': ('isValidOclgrind', ['oclgrind-optimised', 'oclgrind-unoptimised'], 'oclgrindConcurrency'),
+        'oclgrind-small-optimised': ('runOclgrindSmallOptimised', [], None),
+        'oclgrind-small-unoptimised': ('runOclgrindSmallUnoptimised', [], None),
+        'oclgrind-small-valid': ('isValidOclgrind', ['oclgrind-small-optimised', 'oclgrind-small-unoptimised'], 'oclgrindConcurrency'),
+        'oclgrind-tiered-valid': ('isValidOclgrindTiered', ['oclgrind-small-valid', 'oclgrind-valid'], None),
+        'oclgrind-miscompiled': ('isMiscompiledOclgrind', ['oclgrind-optimised', 'oclgrind-unoptimised'], 'oclgrindConcurrency'),
+        'oclgrind-optimised-completed': ('hasCompleted', ['oclgrind-optimised'], None),
+        'oclgrind-unoptimised-completed': ('hasCompleted', ['oclgrind-unoptimised'], None),
+        'kernel-optimised-valid': ('isSuccessful', ['kernel-optimised'], None),
+        'miscompiled': ('isMiscompiled', ['kernel-optimised', 'kernel-unoptimised'], 'deviceConcurrency'),
+        'crash-unoptimised': ('isCompilerCrashUnoptimised', ['kernel-optimised', 'kernel-unoptimised'], None),
+        'kernel-divergence': ('getKernelDivergence', ['kernel-optimised', 'kernel-unoptimised'], 'deviceConcurrency'),
+    }
+
+    # Tool stage -> (line handler, consumers which accept that the tool is stopped at the first disqualifying line)
+    earlyRejections = {
+        'clang': ('rejectClangLine', ['clang-valid']),
+        'clang-syntax': ('rejectClangLine', ['clang-syntax-valid']),
+        'clang-analyzer': ('rejectClangAnalyzerLine', ['clang-analyzer-valid']),
+        'oclgrind-optimised': ('rejectOclgrindLine', ['oclgrind-valid', 'oclgrind-miscompiled']),
+        'oclgrind-unoptimised': ('rejectOclgrindLine', ['oclgrind-valid', 'oclgrind-miscompiled']),
+        'oclgrind-small-optimised': ('rejectOclgrindLine', ['oclgrind-small-valid']),
+        'oclgrind-small-unoptimised': ('rejectOclgrindLine', ['oclgrind-small-valid']),
+    }
+
+    # Stages which are replaced if Oclgrind first emulates a single work-group
+    oclgrindTieredStages = {'oclgrind-valid': 'oclgrind-tiered-valid'}
+
+    # Stages which invoke external tools, the duration of some depends on the number of work-items
+    toolStages = ['clang', 'clang-syntax', 'clang-analyzer', 'oclgrind-optimised', 'oclgrind-unoptimised', 'oclgrind-small-optimised', 'oclgrind-small-unoptimised', 'kernel-optimised', 'kernel-unoptimised']
+    workItemStages = ['oclgrind-optimised', 'oclgrind-unoptimised', 'kernel-optimised', 'kernel-unoptimised']
+
+    # Maximum number of divergent work-items which are reported
+    divergenceLimit = 4096
+
+    def __init__(self, test, openCLEnv, kernelName, testPlatform, testDevice, outputFile = None, progressFile = None, cache = None, timings = None):
         self.test = test
         self.openCLEnv = openCLEnv
         self.kernelName = kernelName
@@ -28,138 +350,309 @@ class InterestingnessTest:
         self.testDevice = testDevice
         self.outputFile = outputFile
         self.progressFile = progressFile
+        self.cache = cache
+        self.timings = timings
+        self.stageOutputs = {}
+        # Tool stages which timed out, their outcome depends on the load
+        self.incompleteStages = set()
 
         with open(kernelName, 'r') as f:
             self.kernelContent = f.read()
 
+    def copyForKernel(self, kernelName):
+        return type(self)(self.test, self.openCLEnv, kernelName, self.testPlatform, self.testDevice, self.outputFile, self.progressFile, self.cache, self.timings)
+
+    def discardStageOutputs(self):
+        # Spilled tool output is kept in temporary files until the outputs are discarded
+        for output in self.stageOutputs.values():
+            if isinstance(output, tuple) and isinstance(output[0], capturedOutput.CapturedOutput):
+                output[0].close()
+
+        self.stageOutputs = {}
+
     def logProgress(self, msg):
         if self.progressFile:
             print(msg, file = self.progressFile)
 
     def logOutput(self, output):
         if self.outputFile:
-            print(output, file=self.outputFile)
+            # One write per record, parallel tests append to the same log
+            self.outputFile.write(str(output) + '\n')
 
     def getWorkItemCount(self):
-        m = re.match('//.* -g ([0-9]+),([0-9]+),([0-9]+) -l ([0-9]+),([0-9]+),([0-9]+)', self.kernelContent)
+        return scanKernel(self.kernelContent).getWorkItemCount()
+
+    def isValidResultAccess(self):
+        return scanKernel(self.kernelContent).hasValidResultAccess
+
+    def getTimeLimit(self, stage):
+        if self.timings is None:
+            return 300
+
+        if stage in self.workItemStages:
+            return self.timings.getTimeLimit(stage, self.getWorkItemCount())
+
+        return self.timings.getTimeLimit(stage)
+
+    def getTestStages(self):
+        testStages = self.testStages.get(self.test)
+
+        if testStages is None or not self.openCLEnv.oclgrindTiered:
+            return testStages
+
+        # A single work-group is only cheaper if the NDRange has more than one
+        kernelScan = scanKernel(self.kernelContent)
+
+        if kernelScan.globalDimensions is None or kernelScan.globalDimensions == kernelScan.localDimensions:
+            return testStages
+
+        return [self.oclgrindTieredStages.get(stage, stage) for stage in testStages]
+
+    def getRequiredStages(self):
+        requiredStages = set()
+        pendingStages = [stage.lstrip('!') for stage in self.getTestStages() or []]
 
-        if m == None:
+        while pendingStages:
+            stage = pendingStages.pop()
+
+            if stage not in requiredStages:
+                requiredStages.add(stage)
+                pendingStages.extend(self.stageGraph[stage][1])
+
+        return requiredStages
+
+    def getLineHandler(self, toolStage):
+        if toolStage not in self.earlyRejections:
             return None
 
-        return int(m.group(1)) * int(m.group(2)) * int(m.group(3))
+        (lineHandler, tolerantStages) = self.earlyRejections[toolStage]
 
-    def isValidResultAccess(self):
-        return not re.search('result\s*\[', self.kernelContent) or re.search('result\s*\[\s*get_linear_global_id\s*\(\s*\)\s*\]', self.kernelContent)
+        # Consumers which need the complete output prevent early rejection
+        for stage in self.getRequiredStages():
+            if toolStage in self.stageGraph[stage][1] and stage not in tolerantStages:
+                return None
+
+        return getattr(self, lineHandler)
+
+    def rejectLine(self, tool, line):
+        rule = diagnosticRules.getDiagnosticRules(tool).match(line)
+
+        if rule is None:
+            return False
+
+        self.logProgress('Rejected by rule ' + rule)
+
+        return True
+
+    def rejectClangLine(self, line):
+        return self.rejectLine('clang', line)
+
+    def rejectClangAnalyzerLine(self, line):
+        return self.rejectLine('clang-analyzer', line)
+
+    def rejectOclgrindLine(self, line):
+        return self.rejectLine('oclgrind', line)
+
+    @staticmethod
+    def isSuccessfulOutput(output):
+        if isinstance(output, tuple):
+            return output[1] == 0
+
+        return output is True
+
+    def getStage(self, stage, cancellation = None):
+        if stage in self.stageOutputs:
+            return self.stageOutputs[stage]
+
+        (method, dependencies, concurrency) = self.stageGraph[stage]
+        dependencyOutputs = self.evaluateDependencies(dependencies, getattr(self.openCLEnv, concurrency) if concurrency else 1)
+
+        startTime = time.monotonic()
+
+        if cancellation is not None:
+            output = getattr(self, method)(*dependencyOutputs, cancellation = cancellation)
+        else:
+            output = getattr(self, method)(*dependencyOutputs)
+
+        if self.timings is not None and self.timings.calibrating and stage in self.toolStages:
+            self.timings.record(stage, time.monotonic() - startTime)
+
+        # Cancelled invocations are decided by the other one
+        if output is None and stage in self.toolStages and (cancellation is None or not cancellation.isCancelled()):
+            self.incompleteStages.add(stage)
+
+        self.logUsage(stage, output)
+
+        self.stageOutputs[stage] = output
+        return output
+
+    def logUsage(self, stage, output):
+        if stage in self.toolStages and output is not None and len(output) > 2 and output[2] is not None:
+            self.logProgress('Usage %s: %s' % (stage, output[2]))
+
+    def evaluateDependencies(self, dependencies, concurrency):
+        pendingDependencies = [dependency for dependency in dependencies if dependency not in self.stageOutputs]
+
+        # Independent tool invocations can run side by side
+        if concurrency >= 2 and len(pendingDependencies) == 2:
+            self.openCLEnv.runPaired(lambda cancellation: self.getStage(pendingDependencies[0], cancellation),
+                                     lambda cancellation: self.getStage(pendingDependencies[1], cancellation),
+                                     concurrency)
+
+        dependencyOutputs = [None] * len(dependencies)
+
+        for (index, dependency) in enumerate(dependencies):
+            dependencyOutputs[index] = self.getStage(dependency)
+
+            if not self.isSuccessfulOutput(dependencyOutputs[index]):
+                break
+
+        return dependencyOutputs
+
+    def runClang(self, cancellation = None):
+        self.logProgress('Clang CL')
+        return self.openCLEnv.runClangCL([self.kernelName], self.getTimeLimit('clang'), self.getLineHandler('clang'))
+
+    def runClangSyntax(self, cancellation = None):
+        self.logProgress('Clang CL syntax')
+        return self.openCLEnv.runClangCL([self.kernelName], self.getTimeLimit('clang-syntax'), self.getLineHandler('clang-syntax'), syntaxOnly = True)
+
+    def runClangAnalyzer(self, cancellation = None):
+        self.logProgress('Clang Static Analyzer')
+        return self.openCLEnv.runClangStaticAnalyzer([self.kernelName], self.getTimeLimit('clang-analyzer'), self.getLineHandler('clang-analyzer'))
+
+    def runOclgrindOptimised(self, cancellation = None):
+        self.logProgress('Run Oclgrind optimised')
+        return self.openCLEnv.runOclgrindClLauncher(self.kernelName, self.getTimeLimit('oclgrind-optimised'), optimised = True, cancellation = cancellation, lineHandler = self.getLineHandler('oclgrind-optimised'))
+
+    def runOclgrindUnoptimised(self, cancellation = None):
+        self.logProgress('Run Oclgrind unoptimised')
+        return self.openCLEnv.runOclgrindClLauncher(self.kernelName, self.getTimeLimit('oclgrind-unoptimised'), optimised = False, cancellation = cancellation, lineHandler = self.getLineHandler('oclgrind-unoptimised'))
+
+    def writeSingleWorkGroupKernel(self):
+        # The shrunk NDRange is emulated on a copy next to the kernel
+        (fd, smallKernelName) = tempfile.mkstemp(prefix='_small.', suffix='.cl', dir=os.path.dirname(os.path.abspath(self.kernelName)))
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(getSingleWorkGroupKernel(self.kernelContent))
+
+        return smallKernelName
+
+    def runOclgrindSmall(self, stage, optimised, cancellation = None):
+        smallKernelName = self.writeSingleWorkGroupKernel()
 
-    def isValidClang(self):
-        clangInvocation = self.openCLEnv.runClangCL([self.kernelName], 300)
+        try:
+            return self.openCLEnv.runOclgrindClLauncher(smallKernelName, self.getTimeLimit(stage), optimised = optimised, cancellation = cancellation, lineHandler = self.getLineHandler(stage))
+        finally:
+            os.remove(smallKernelName)
+
+    def runOclgrindSmallOptimised(self, cancellation = None):
+        self.logProgress('Run Oclgrind single work-group optimised')
+        return self.runOclgrindSmall('oclgrind-small-optimised', True, cancellation)
+
+    def runOclgrindSmallUnoptimised(self, cancellation = None):
+        self.logProgress('Run Oclgrind single work-group unoptimised')
+        return self.runOclgrindSmall('oclgrind-small-unoptimised', False, cancellation)
+
+    def runKernelOptimised(self, cancellation = None):
+        self.logProgress('Run optimised')
+        invocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, self.getTimeLimit('kernel-optimised'), cancellation = cancellation)
+
+        if invocation:
+            self.logProgress('Optimised result: ' + str(invocation[0]));
+
+        return invocation
+
+    def runKernelUnoptimised(self, cancellation = None):
+        self.logProgress('Run unoptimised')
+        invocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, self.getTimeLimit('kernel-unoptimised'), optimised = False, cancellation = cancellation)
+
+        if invocation:
+            self.logProgress('Unoptimised result: ' + str(invocation[0]));
+
+        return invocation
 
+    def isValidClang(self, clangInvocation):
         if clangInvocation is not None and clangInvocation[1] == 0:
             self.logOutput(clangInvocation[0])
 
-            if ('warning: empty struct is a GNU extension' not in clangInvocation[0] and
-                'warning: use of GNU empty initializer extension' not in clangInvocation[0] and
-                'warning: incompatible pointer to integer conversion' not in clangInvocation[0] and
-                'warning: incompatible integer to pointer conversion' not in clangInvocation[0] and
-                'warning: incompatible pointer types initializing' not in clangInvocation[0] and
-                'warning: comparison between pointer and integer' not in clangInvocation[0] and
-                'warning: ordered comparison between pointer and integer' not in clangInvocation[0] and
-                'warning: ordered comparison between pointer and zero' not in clangInvocation[0] and
-                'is uninitialized when used within its own initialization [-Wuninitialized]' not in clangInvocation[0] and
-                'is uninitialized when used here [-Wuninitialized]' not in clangInvocation[0] and
-                'may be uninitialized when used here [-Wconditional-uninitialized]' not in clangInvocation[0] and
-                'warning: use of GNU ?: conditional expression extension, omitting middle operand' not in clangInvocation[0] and
-                'warning: control may reach end of non-void function [-Wreturn-type]' not in clangInvocation[0] and
-                'warning: control reaches end of non-void function [-Wreturn-type]' not in clangInvocation[0] and
-                'warning: zero size arrays are an extension [-Wzero-length-array]' not in clangInvocation[0] and
-                'excess elements in ' not in clangInvocation[0] and
-                'warning: address of stack memory associated with local variable' not in clangInvocation[0] and
-                'warning: type specifier missing' not in clangInvocation[0] and
-                "warning: expected ';' at end of declaration list" not in clangInvocation[0] and
-                ' declaration specifier [-Wduplicate-decl-specifier]' not in clangInvocation[0]):
+            rule = diagnosticRules.getDiagnosticRules('clang').match(clangInvocation[0])
+
+            if rule is None:
                 return True
 
+            self.logProgress('Rejected by rule ' + rule)
+
         return False
 
+    def isValidClangTiered(self, isValidClangSyntax, isValidClang):
+        return isValidClangSyntax is True and isValidClang is True
+
     def isValidClangAnalyzer(self):
         return True
-        clangAnalyzerInvocation = self.openCLEnv.runClangStaticAnalyzer([self.kernelName], 300)
+        clangAnalyzerInvocation = self.getStage('clang-analyzer')
 
         if clangAnalyzerInvocation is not None and clangAnalyzerInvocation[1] == 0:
             self.logOutput(clangAnalyzerInvocation[0])
 
-            if ('warning: Assigned value is garbage or undefined' not in clangAnalyzerInvocation[0] and
-                'warning: Undefined or garbage value returned to caller' not in clangAnalyzerInvocation[0] and
-                'is a garbage value' not in clangAnalyzerInvocation[0] and
-                'warning: Dereference of null pointer' not in clangAnalyzerInvocation[0] and
-                'warning: Array subscript is undefined' not in clangAnalyzerInvocation[0] and
-                'results in a dereference of a null pointer' not in clangAnalyzerInvocation[0]):
+            rule = diagnosticRules.getDiagnosticRules('clang-analyzer').match(clangAnalyzerInvocation[0])
+
+            if rule is None:
                 return True
 
+            self.logProgress('Rejected by rule ' + rule)
+
         return False
 
+    def isWellFormedKernel(self):
+        # Reject broken variants before any tool is started
+        self.logProgress('Structure')
+        return scanKernel(self.kernelContent).isBalanced is not False
+
     def isValidCLLauncherKernel(self):
+        kernelScan = scanKernel(self.kernelContent)
+
         # Make sure comment with dimensions is preserved
         self.logProgress('Dimension')
-        m = re.match('//.* -g [0-9]+,[0-9]+,[0-9]+ -l [0-9]+,[0-9]+,[0-9]+', self.kernelContent)
-
-        if m == None:
+        if kernelScan.globalDimensions is None:
             return False
 
         #grep -E '// Seed: [0-9]+' ${KERNEL} > /dev/null 2>&1 &&\
 
         # Access to result only with get_linear_global_id()
         self.logProgress('Result')
-        if not self.isValidResultAccess():
+        if not kernelScan.hasValidResultAccess:
             return False
 
         # Must not change get_linear_global_id
-        # TODO: Improve
         # TODO: Do I need this or will Oclgrind check it too
         self.logProgress('Id')
-        if not re.search('return\s*\(\s*get_global_id\s*\(\s*2\s*\)\s*\*\s*get_global_size\s*\(\s*1\s*\)\s*\+\s*get_global_id\s*\(\s*1\s*\)\s*\)\s*\*\s*get_global_size\s*\(\s*0\s*\)\s*\+\s*get_global_id\s*\(\s*0\s*\)\s*;', self.kernelContent):
+        if not kernelScan.hasLinearId:
             return False
 
         return True
 
-    def isStaticallyValid(self):
+    def isStaticallyValid(self, isValidClang, isValidClangAnalyzer):
         # Run static analysis of the program
         # Better support for uninitialised values
-        self.logProgress('Clang CL')
-        if not self.isValidClang():
-            return False
-
-        self.logProgress('Clang Static Analyzer')
-        if not self.isValidClangAnalyzer():
-            return False
-
-        return True
-
-    def isValidOclgrind(self):
-        oclgrindInvocationOpt = self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300, optimised = True)
+        return isValidClang is True and isValidClangAnalyzer is True
 
+    def isValidOclgrind(self, oclgrindInvocationOpt, oclgrindInvocationUnopt):
         if oclgrindInvocationOpt is None or oclgrindInvocationOpt[1] != 0:
             return False
 
-        oclgrindInvocationUnopt = self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300, optimised = False)
-
         if oclgrindInvocationUnopt is None or oclgrindInvocationUnopt[1] != 0:
             return False
 
         return True
 
-    def isMiscompiled(self):
-        self.logProgress('Run optimised')
-        optimisedInvocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, 300)
-        if optimisedInvocation:
-            self.logProgress('Optimised result: ' + optimisedInvocation[0]);
+    def isValidOclgrindTiered(self, isValidOclgrindSmall, isValidOclgrind):
+        return isValidOclgrindSmall is True and isValidOclgrind is True
+
+    def isMiscompiled(self, optimisedInvocation, unoptimisedInvocation):
         if optimisedInvocation is None or optimisedInvocation[1] != 0:
             return False
 
-        self.logProgress('Run unoptimised')
-        unoptimisedInvocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, 300, optimised = False)
-        if unoptimisedInvocation:
-            self.logProgress('Unoptimised result: ' + unoptimisedInvocation[0]);
         if unoptimisedInvocation is None or unoptimisedInvocation[1] != 0:
             return False
 
@@ -167,24 +660,29 @@ class InterestingnessTest:
         if optimisedInvocation[0] == unoptimisedInvocation[0]:
             return False
 
+        self.logProgress('Different')
+
         return True
 
-    def isMiscompiledOclgrind(self):
-        self.logProgress('Run optimised')
-        optimisedInvocation = self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300)
-        if optimisedInvocation is None or optimisedInvocation[1] != 0:
-            return False
+    def getKernelDivergence(self, optimisedInvocation, unoptimisedInvocation):
+        if not self.isSuccessful(optimisedInvocation) or not self.isSuccessful(unoptimisedInvocation):
+            return None
 
-        self.logProgress('Run unoptimised')
-        unoptimisedInvocation = self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300, optimised = False)
-        if unoptimisedInvocation is None or unoptimisedInvocation[1] != 0:
-            return False
+        return getDivergentWorkItems(optimisedInvocation[0], unoptimisedInvocation[0], self.divergenceLimit)
 
-        self.logProgress('Diff')
-        if optimisedInvocation[0] == unoptimisedInvocation[0]:
-            return False
+    def getDivergentWorkItems(self):
+        # Linear indices of the work-items whose results differ between the optimised and unoptimised run
+        with open(self.kernelName, 'r') as f:
+            kernelContent = f.read()
 
-        return True
+        if kernelContent != self.kernelContent:
+            self.kernelContent = kernelContent
+            self.discardStageOutputs()
+
+        return self.getStage('kernel-divergence')
+
+    def isMiscompiledOclgrind(self, optimisedInvocation, unoptimisedInvocation):
+        return self.isMiscompiled(optimisedInvocation, unoptimisedInvocation)
 
     #def isFalsePositiveUninitializedOclgrind(self):
     #    oclgrindArgsNew = ['-Wall', '--memcheck-uninitialized', '--data-races', '--uniform-writes']
@@ -207,122 +705,107 @@ class InterestingnessTest:
 
     #    return True
 
-    def isValid(self):
-        if not self.isValidCLLauncherKernel():
+    def isCompilerCrashUnoptimised(self, optimisedInvocation, unoptimisedInvocation):
+        if optimisedInvocation is None or optimisedInvocation[1] != 0:
             return False
 
-        if not self.isStaticallyValid():
+        if unoptimisedInvocation is not None and unoptimisedInvocation[1] == 0:
             return False
 
-        self.logProgress('Run Oclgrind')
-        if not self.isValidOclgrind():
-            return False
+        self.logProgress('Crash unoptimised')
 
         return True
 
-    def isValidMiscompilation(self):
-        if not self.isValid():
+    def hasClangError(self, clangInvocation, err):
+        if clangInvocation is None or clangInvocation[1] == 0:
             return False
 
-        if not self.isMiscompiled():
+        if err not in clangInvocation[0]:
             return False
 
-        self.logProgress('Different')
-
         return True
 
-    def isValidMiscompilationOclgrind(self):
-        if not self.isValid():
+    def hasVectorError(self, clangInvocation):
+        if not self.hasClangError(clangInvocation, "error: can't convert between vector values of different size"):
             return False
 
-        if not self.isMiscompiledOclgrind():
-            return False
-
-        self.logProgress('Different')
+        self.logProgress('Vector crash')
 
         return True
 
-    def isCompilerCrashUnoptimised(self):
-        if not self.isValidCLLauncherKernel():
-            return False
+    def hasCompleted(self, invocation):
+        return invocation is not None
 
-        if not self.isStaticallyValid():
-            return False
+    def isSuccessful(self, invocation):
+        return invocation is not None and invocation[1] == 0
 
-        self.logProgress('Run Oclgrind')
-        if not self.isValidOclgrind():
-            return False
+    def runTest(self):
+        # The kernel might have been rewritten since the test was created
+        with open(self.kernelName, 'r') as f:
+            self.kernelContent = f.read()
 
-        self.logProgress('Run optimised')
-        optimisedInvocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, 300)
-        if optimisedInvocation is None or optimisedInvocation[1] != 0:
-            return False
+        if self.cache is None or (self.timings is not None and self.timings.calibrating):
+            return self.evaluateTest()
 
-        self.logProgress('Run unoptimised')
-        unoptimisedInvocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, 300, optimised = False)
-        if unoptimisedInvocation is not None and unoptimisedInvocation[1] == 0:
-            return False
+        configuration = self.openCLEnv.getConfiguration() + [diagnosticRules.getDiagnosticRulesDigest()]
 
-        self.logProgress('Crash unoptimised')
+        if self.timings is not None:
+            configuration = configuration + [self.timings.getConfiguration()]
 
-        return True
+        key = self.cache.getKey(self.kernelContent, self.test, self.testPlatform, self.testDevice, configuration)
+        verdict = self.cache.get(key)
 
-    def hasClangError(self, err):
-        clangInvocation = self.openCLEnv.runClangCL([self.kernelName], 300)
+        if verdict is not None:
+            self.logProgress('Cached verdict')
+            return verdict
 
-        if clangInvocation is None or clangInvocation[1] == 0:
-            return False
+        verdict = self.evaluateTest()
 
-        if err not in clangInvocation[0]:
-            return False
+        if self.incompleteStages:
+            self.logProgress('Verdict not cached')
+        else:
+            self.cache.put(key, verdict)
 
-        self.logProgress('Vector crash')
+        return verdict
 
-        return True
+    def evaluateTest(self):
+        self.discardStageOutputs()
+        self.incompleteStages = set()
 
-    def runTest(self):
-        if self.test == 'crash-unoptimised':
-            return self.isCompilerCrashUnoptimised()
-        elif self.test == 'wrong-code':
-            return self.isMiscompiled()
-        elif self.test == 'miscompilation':
-            return self.isValidMiscompilation()
-        elif self.test == 'oclgrind-miscompilation':
-            return self.isValidMiscompilationOclgrind()
-        elif self.test == 'oclgrind-optimised':
-            return not self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300) is not None
-        elif self.test == 'oclgrind-uninitialized':
+        if self.test == 'oclgrind-uninitialized':
             print('Deprecated!', file=sys.stderr)
             return False
         #    return self.isFalsePositiveUninitializedOclgrind()
-        elif self.test == 'statically-valid':
-            return self.isStaticallyValid()
-        elif self.test == 'csa-invalid':
-            if not self.isValidClang():
-                return False
 
-            if self.isValidClangAnalyzer():
-                return False
+        testStages = self.getTestStages()
 
-            return self.openCLEnv.runOclgrindClLauncher(self.kernelName, 300, False) is not None
-        elif self.test == 'error-vector':
-            if not self.isValidCLLauncherKernel():
-                return False
+        if testStages is None:
+            return False
 
-            if not self.hasClangError("error: can't convert between vector values of different size"):
-                return False
+        for stage in testStages:
+            expectSuccess = not stage.startswith('!')
 
-            optimisedInvocation = self.openCLEnv.runKernel(self.testPlatform, self.testDevice, self.kernelName, 300)
-            if optimisedInvocation is None or optimisedInvocation[1] != 0:
+            if self.getStage(stage.lstrip('!')) is not expectSuccess:
                 return False
 
-            return True
-        elif self.test == 'valid':
-            return self.isValid()
-
-        return False
+        return True
 
 class OpenCLEnv:
+    clangOclArgs = ['-x', 'cl', '-fno-builtin', '-Dcl_clang_storage_class_specifiers']
+    clangHeaderArgs = ['-include', 'clc/clc.h']
+    clangDiagArgs = ['-g', '-c', '-Wall', '-Wextra', '-pedantic', '-Wconditional-uninitialized', '-Weverything', '-Wno-reserved-id-macro', '-fno-caret-diagnostics', '-fno-diagnostics-fixit-info', '-O1']
+    oclgrindArgs = []
+
+    #TODO: Maybe use scan-build?!
+    #clangAnalyzerArgs = ['-Xclang', '-analyze', '-Xclang', '-analyzer-checker', '-Xclang', 'alpha,core,security,unix']
+    clangAnalyzerArgs = ['--analyze', '-Xclang', '-analyzer-checker', '-Xclang', 'alpha,core,security,unix']
+
+    # Longest line of captured output which is passed to line handlers
+    maxLineLength = 1 << 16
+
+    # Time limit for precompiling the libclc header
+    pchTimeLimit = 600
+
     def __init__(self, clLauncher, clang, libclcIncludePath):
         self.clLauncher = clLauncher
         self.clang = clang
@@ -331,112 +814,483 @@ class OpenCLEnv:
         self.oclgrindPlatform = 0
         self.oclgrindDevice = 0
 
-    def check_output(self, args, timeLimit):
+        # Maximum number of simultaneous runs per device
+        self.deviceConcurrency = 1
+        self.oclgrindConcurrency = 1
+
+        self.configuration = None
+
+        # Wrapper which applies the resource limits on Unix, resolved on first use
+        self.prlimit = None
+
+        # Bytes of cl_launcher and Oclgrind output kept in memory, the rest is spilled to a temporary file
+        self.captureLimit = 1 << 20
+
+        # Directory for the device lock files which are shared between processes, disabled if None
+        self.lockDir = None
+
+        # Equivalent devices which replace the device under test, disabled if None
+        self.devicePool = None
+
+        # Emulate a single work-group with Oclgrind before the full NDRange
+        self.oclgrindTiered = False
+
+        # Directory for precompiled libclc headers, disabled if None
+        self.pchDir = None
+        self.pchName = None
+
+        # (address space in bytes, CPU seconds) for clang and Oclgrind, either may be None
+        # Kernel runs are not limited, OpenCL drivers reserve large amounts of address space
+        self.resourceLimits = None
+
+    def getToolConfiguration(self, tool):
+        if tool is None:
+            return None
+
+        toolPath = which(tool)
+
+        if toolPath is None:
+            return [tool, None]
+
+        # Rebuilt tools must not reuse verdicts of the old binary
+        toolStat = os.stat(toolPath)
+        return [os.path.abspath(toolPath), toolStat.st_size, toolStat.st_mtime]
+
+    def getConfiguration(self):
+        # Resolved once, long running processes reuse it for every kernel
+        if self.configuration is None:
+            self.configuration = self.resolveConfiguration()
+
+        return self.configuration
+
+    def resolveConfiguration(self):
+        return [type(self).__name__,
+                self.getToolConfiguration(self.clLauncher),
+                self.getToolConfiguration(self.clang),
+                self.getToolConfiguration('oclgrind'),
+                self.libclcIncludePath,
+                str(self.oclgrindPlatform),
+                str(self.oclgrindDevice),
+                self.clangOclArgs,
+                self.clangHeaderArgs,
+                self.clangDiagArgs,
+                self.oclgrindArgs,
+                self.devicePool.devices if self.devicePool is not None else None,
+                self.oclgrindTiered,
+                self.resourceLimits]
+
+    def getProcessOptions(self):
+        return {}
+
+    def getLimitedCommand(self, args, resourceLimits = None):
+        return args
+
+    def startProcess(self, args, env, cwd = None, text = True, resourceLimits = None, stderr = subprocess.STDOUT):
+        return subprocess.Popen(self.getLimitedCommand(args, resourceLimits), universal_newlines=text, stdout=subprocess.PIPE, stderr=stderr, env=env, cwd=cwd, **self.getProcessOptions())
+
+    def waitProcess(self, proc, resourceLimits = None, timeLimit = None):
+        # Resource usage is only available where the process can be reaped with wait4
+        proc.wait(timeLimit)
+        return None
+
+    def killProcess(self, proc):
+        proc.kill()
+
+    def communicateLines(self, proc, timeLimit, lineHandler, keepOutput = True):
+        lines = []
+
+        def readLines():
+            for line in proc.stdout:
+                if keepOutput:
+                    lines.append(line)
+
+                # Stop the process as soon as its output disqualifies the kernel
+                if lineHandler is not None and lineHandler(line):
+                    self.killProcess(proc)
+                    break
+
+        reader = threading.Thread(target=readLines)
+        reader.start()
+        reader.join(timeLimit)
+
+        if reader.is_alive():
+            self.killProcess(proc)
+            reader.join()
+            raise subprocess.TimeoutExpired(proc.args, timeLimit)
+
+        return ''.join(lines)
+
+    def communicateCaptured(self, proc, timeLimit, lineHandler, captureLimit):
+        output = capturedOutput.CapturedOutput(captureLimit)
+
+        def readChunks():
+            lineSplitter = LineSplitter(self.maxLineLength)
+
+            while True:
+                chunk = proc.stdout.read1(1 << 16)
+
+                if not chunk:
+                    break
+
+                output.write(chunk)
+
+                # Stop the process as soon as its output disqualifies the kernel
+                if lineHandler is not None and any(lineHandler(line) for line in lineSplitter.feed(chunk)):
+                    self.killProcess(proc)
+                    return
+
+            if lineHandler is not None and any(lineHandler(line) for line in lineSplitter.finish()):
+                self.killProcess(proc)
+
+        reader = threading.Thread(target=readChunks)
+        reader.start()
+        reader.join(timeLimit)
+
+        if reader.is_alive():
+            self.killProcess(proc)
+            reader.join()
+            output.close()
+            raise subprocess.TimeoutExpired(proc.args, timeLimit)
+
+        return output
+
+    def check_output(self, args, timeLimit, cancellation = None, env = None, lineHandler = None, cwd = None, captureLimit = None, resourceLimits = None):
+        # With a capture limit the output is returned as CapturedOutput instead of text
+        deadline = time.monotonic() + timeLimit
+        proc = self.startProcess(args, env, cwd, text = captureLimit is None, resourceLimits = resourceLimits)
+
+        if cancellation is not None:
+            cancellation.register(proc, self.killProcess)
+
         try:
-            output = subprocess.check_output(args, universal_newlines=True, stderr=subprocess.STDOUT, timeout=timeLimit)
-            return (output, 0)
-        except subprocess.CalledProcessError as err:
-            return (err.output, err.returncode)
+            if captureLimit is not None:
+                output = self.communicateCaptured(proc, timeLimit, lineHandler, captureLimit)
+            else:
+                output = self.communicateLines(proc, timeLimit, lineHandler)
+
+            # The output may end before the process, e.g. if it closes its stdout early
+            usage = self.waitProcess(proc, resourceLimits, max(deadline - time.monotonic(), 0))
         except subprocess.SubprocessError:
+            self.killProcess(proc)
+            proc.communicate()
             return None
+        finally:
+            if cancellation is not None:
+                cancellation.unregister(proc)
+
+        if cancellation is not None and cancellation.isCancelled():
+            if captureLimit is not None:
+                output.close()
+
+            return None
+
+        return (output, proc.returncode, usage)
 
-    def runClangCL(self, args, timeLimit):
-        oclArgs = ['-x', 'cl', '-fno-builtin', '-include', 'clc/clc.h', '-Dcl_clang_storage_class_specifiers']
+    def runPaired(self, runFirst, runSecond, concurrency = 1):
+        # Both invocations have to succeed, hence the first failure cancels the other one
+        if concurrency < 2:
+            firstInvocation = runFirst(None)
+
+            if not isSuccessfulInvocation(firstInvocation):
+                return (firstInvocation, None)
+
+            return (firstInvocation, runSecond(None))
+
+        cancellation = Cancellation()
+        invocations = [None, None]
+
+        def run(index, invocation):
+            invocations[index] = invocation(cancellation)
+
+            if not isSuccessfulInvocation(invocations[index]):
+                cancellation.cancel()
+
+        firstThread = threading.Thread(target=run, args=(0, runFirst))
+        firstThread.start()
+        run(1, runSecond)
+        firstThread.join()
+
+        return tuple(invocations)
+
+    def getClangOclArgs(self):
+        oclArgs = list(self.clangOclArgs)
 
         if self.libclcIncludePath:
             oclArgs.extend(['-I', self.libclcIncludePath])
 
-        diagArgs = ['-g', '-c', '-Wall', '-Wextra', '-pedantic', '-Wconditional-uninitialized', '-Weverything', '-Wno-reserved-id-macro', '-fno-caret-diagnostics', '-fno-diagnostics-fixit-info', '-O1']
-        return self.check_output([self.clang] + oclArgs + diagArgs + args, timeLimit)
+        return oclArgs
 
-    def runClangStaticAnalyzer(self, args, timeLimit):
-        #TODO: Maybe use scan-build?!
-        #analysisArgs = ['-Xclang', '-analyze', '-Xclang', '-analyzer-checker', '-Xclang', 'alpha,core,security,unix']
-        analysisArgs = ['--analyze', '-Xclang', '-analyzer-checker', '-Xclang', 'alpha,core,security,unix']
-        return self.runClangCL(analysisArgs + args, timeLimit)
+    def getPchArgs(self):
+        # The header is built with the warnings of the tests, code generation options have to match as well
+        return [arg for arg in self.clangDiagArgs if arg != '-c']
 
-    def runOclgrindClLauncher(self, kernel, timeLimit, optimised = True):
-        return None
+    def getPrecompiledHeaderName(self):
+        # The header depends on the clang binary and the libclc headers, both are resolved once per environment
+        if self.pchName is None:
+            libclcHeader = os.path.join(self.libclcIncludePath or '', 'clc', 'clc.h')
+            libclcStat = os.stat(libclcHeader) if os.path.isfile(libclcHeader) else None
+            pchConfiguration = [self.getToolConfiguration(self.clang), self.getClangOclArgs(), self.getPchArgs(), libclcStat and libclcStat.st_mtime]
+            self.pchName = os.path.join(self.pchDir, 'clc-%s' % hashlib.sha256(json.dumps(pchConfiguration).encode()).hexdigest())
+
+        return self.pchName
+
+    def getPrecompiledHeader(self):
+        if not self.pchDir:
+            return None
+
+        pchName = self.getPrecompiledHeaderName()
+
+        if os.path.exists(pchName + '.pch'):
+            return pchName + '.pch'
+
+        # Do not retry in every test if the header cannot be precompiled
+        if os.path.exists(pchName + '.failed'):
+            return None
+
+        os.makedirs(self.pchDir, exist_ok=True)
+
+        # Concurrent builders must never see a partially written header
+        tmpSuffix = '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+
+        if not os.path.exists(pchName + '.h'):
+            with open(pchName + '.h' + tmpSuffix, 'w') as f:
+                f.write('#include <clc/clc.h>\n')
+
+            os.replace(pchName + '.h' + tmpSuffix, pchName + '.h')
+
+        # The limit of the test does not apply, the header is built once for all variants
+        tmpPchName = pchName + tmpSuffix
+        pchInvocation = self.check_output([self.clang] + self.getClangOclArgs() + ['-x', 'cl-header'] + self.getPchArgs() + [pchName + '.h', '-o', tmpPchName], self.pchTimeLimit, resourceLimits=self.resourceLimits)
 
-    def runKernel(self, platform, device, kernel, timeLimit, optimised = True):
+        # Diagnostics of the header are not repeated when it is included precompiled, they would be missing from the test output
+        if pchInvocation is None or pchInvocation[1] != 0 or pchInvocation[0].strip() or not os.path.exists(tmpPchName):
+            # Time-outs depend on the load, only a failing build is permanent
+            if pchInvocation is not None and (pchInvocation[1] != 0 or pchInvocation[0].strip()):
+                open(pchName + '.failed', 'w').close()
+
+            if os.path.exists(tmpPchName):
+                os.remove(tmpPchName)
+
+            return None
+
+        os.replace(tmpPchName, pchName + '.pch')
+
+        return pchName + '.pch'
+
+    @staticmethod
+    def isRejectedPrecompiledHeader(invocation):
+        if invocation is None or invocation[1] == 0:
+            return False
+
+        return 'PCH file' in invocation[0] or 'precompiled header' in invocation[0] or 'AST file' in invocation[0]
+
+    def getClangCLCommand(self, args, syntaxOnly = False, precompiledHeader = None):
+        diagArgs = self.clangDiagArgs
+
+        # Frontend diagnostics only, without code generation
+        if syntaxOnly:
+            diagArgs = [arg for arg in diagArgs if arg != '-c'] + ['-fsyntax-only']
+
+        if precompiledHeader:
+            return [self.clang] + self.getClangOclArgs() + ['-include-pch', precompiledHeader] + diagArgs + args
+
+        return [self.clang] + self.getClangOclArgs() + self.clangHeaderArgs + diagArgs + args
+
+    def runClangCL(self, args, timeLimit, lineHandler = None, syntaxOnly = False):
+        precompiledHeader = self.getPrecompiledHeader()
+
+        if precompiledHeader:
+            invocation = self.check_output(self.getClangCLCommand(args, syntaxOnly, precompiledHeader), timeLimit, lineHandler=lineHandler, resourceLimits=self.resourceLimits)
+
+            if not self.isRejectedPrecompiledHeader(invocation):
+                return invocation
+
+            # Stale header, the next test builds a new one
+            try:
+                os.remove(precompiledHeader)
+            except OSError:
+                pass
+
+        return self.check_output(self.getClangCLCommand(args, syntaxOnly), timeLimit, lineHandler=lineHandler, resourceLimits=self.resourceLimits)
+
+    def runClangStaticAnalyzer(self, args, timeLimit, lineHandler = None):
+        return self.runClangCL(self.clangAnalyzerArgs + args, timeLimit, lineHandler)
+
+    def getKernelCommand(self, platform, device, kernel, optimised = True):
         args = [self.clLauncher, '-p', str(platform), '-d', str(device), '-f', kernel]
 
         if not optimised:
             args.append('---disable_opts')
 
-        return self.check_output(args, timeLimit)
+        return args
+
+    def getOclgrindCommand(self, kernel, optimised = True):
+        # Arguments and environment, None if Oclgrind is not supported
+        return None
+
+    def runOclgrindClLauncher(self, kernel, timeLimit, optimised = True, cancellation = None, lineHandler = None):
+        command = self.getOclgrindCommand(kernel, optimised)
+
+        if command is None:
+            return None
+
+        (args, env) = command
+
+        # Oclgrind emulates the device on the CPU, only the paired runs of one test are limited by oclgrindConcurrency
+        return self.check_output(args, timeLimit, cancellation, env=env, lineHandler=lineHandler, captureLimit=self.captureLimit, resourceLimits=self.resourceLimits)
+
+    def leaseDevice(self, platform, device):
+        # Other test processes, e.g. parallel C-Reduce workers, share the device
+        if self.lockDir is None:
+            return contextlib.nullcontext()
+
+        return deviceLease.DeviceLease(self.lockDir, ('device', platform, device), self.deviceConcurrency)
+
+    def runKernel(self, platform, device, kernel, timeLimit, optimised = True, cancellation = None, lineHandler = None):
+        # With a device pool every run goes to the least loaded device
+        if self.devicePool is not None:
+            with self.devicePool.lease() as (platform, device):
+                return self.runKernelOnDevice(platform, device, kernel, timeLimit, optimised, cancellation, lineHandler)
+
+        with getDeviceSemaphore((str(platform), str(device)), self.deviceConcurrency), self.leaseDevice(platform, device):
+            return self.runKernelOnDevice(platform, device, kernel, timeLimit, optimised, cancellation, lineHandler)
+
+    def runKernelOnDevice(self, platform, device, kernel, timeLimit, optimised = True, cancellation = None, lineHandler = None):
+        return self.check_output(self.getKernelCommand(platform, device, kernel, optimised), timeLimit, cancellation, lineHandler=lineHandler, captureLimit=self.captureLimit)
 
 class UnixOpenCLEnv(OpenCLEnv):
-    def check_output(self, args, timeLimit):
+    oclgrindArgs = ['-Wall', '--uninitialized', '--data-races', '--uniform-writes', '--stop-errors', '1']
+
+    def getProcessOptions(self):
+        # Own process group, hence all children are killed on timeout
+        return {'start_new_session': True}
+
+    def getLimitedCommand(self, args, resourceLimits = None):
+        # The limits are set by a wrapper which execs the tool, preexec_fn is not safe with threads and forces fork
+        if resourceLimits is None:
+            return args
+
+        (memoryLimit, cpuLimit) = resourceLimits
+
+        if self.prlimit is None:
+            self.prlimit = which('prlimit') or ''
+
+        if not self.prlimit:
+            return [sys.executable, '-c', resourceLimitShim, str(memoryLimit or ''), str(cpuLimit or '')] + args
+
+        limitArgs = []
+
+        if memoryLimit is not None:
+            limitArgs.append('--as=%d' % memoryLimit)
+
+        if cpuLimit is not None:
+            limitArgs.append('--cpu=%d:%d' % (cpuLimit, cpuLimit + 1))
+
+        return [self.prlimit] + limitArgs + ['--'] + args
+
+    def waitProcess(self, proc, resourceLimits = None, timeLimit = None):
+        deadline = time.monotonic() + timeLimit if timeLimit is not None else None
+        pollInterval = 0.001
+
         try:
-            proc = subprocess.Popen(args, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
-            output, _ = proc.communicate(timeout=timeLimit)
-            return (output, proc.returncode)
-        except subprocess.SubprocessError:
-            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-            proc.communicate()
+            while True:
+                (pid, status, usage) = os.wait4(proc.pid, os.WNOHANG if deadline is not None else 0)
 
-        return None
+                if pid != 0:
+                    break
 
-    def runOclgrindClLauncher(self, kernel, timeLimit, optimised = True):
-        oclgrindArgs = ['-Wall', '--uninitialized', '--data-races', '--uniform-writes', '--stop-errors', '1']
-        args = ['-p', str(self.oclgrindPlatform), '-d', str(self.oclgrindDevice), '-f', kernel]
+                if time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(proc.args, timeLimit)
 
-        if not optimised:
-            args.append('---disable_opts')
+                time.sleep(pollInterval)
+                pollInterval = min(pollInterval * 2, 0.05)
+        except ChildProcessError:
+            proc.wait()
+            return None
+
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        cpuTime = usage.ru_utime + usage.ru_stime
 
-        return self.check_output(['oclgrind'] + oclgrindArgs + [self.clLauncher] + args, timeLimit)
+        if os.WIFSIGNALED(status):
+            signalNumber = os.WTERMSIG(status)
+
+            # The hard CPU limit is enforced with SIGKILL
+            if resourceLimits is not None and resourceLimits[1] is not None and (signalNumber == signal.SIGXCPU or (signalNumber == signal.SIGKILL and cpuTime >= resourceLimits[1])):
+                exitCause = 'cpu-limit'
+            else:
+                # Failed allocations under the address space limit are handled by the tool, e.g. as SIGABRT or SIGSEGV
+                exitCause = signal.Signals(signalNumber).name
+        else:
+            exitCause = 'exit'
+
+        # Kilobytes on Linux, bytes on macOS
+        maxRss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+        return ResourceUsage(cpuTime, maxRss, exitCause)
+
+    def killProcess(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def getOclgrindCommand(self, kernel, optimised = True):
+        return (['oclgrind'] + self.oclgrindArgs + self.getKernelCommand(self.oclgrindPlatform, self.oclgrindDevice, kernel, optimised), None)
 
 class WinOpenCLEnv(OpenCLEnv):
+    oclgrindArgs = ['OCLGRIND_DIAGNOSTIC_OPTIONS=-Wall', 'OCLGRIND_UNINITIALIZED=1', 'OCLGRIND_DATA_RACES=1', 'OCLGRIND_UNIFORM_WRITES=1', 'OCLGRIND_STOP_ERRORS=1']
+
     def __init__(self, clLauncher, clang, libclcIncludePath, oclgrindPlatform, oclgrindDevice):
         super().__init__(clLauncher, clang, libclcIncludePath)
 
         self.oclgrindPlatform = oclgrindPlatform
         self.oclgrindDevice = oclgrindDevice
 
-    def check_output(self, args, timeLimit, env=os.environ):
-        try:
-            proc = subprocess.Popen(args, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP, env=env)
-            output, _ = proc.communicate(timeout=timeLimit)
-            return (output, proc.returncode)
-        except subprocess.SubprocessError:
-            subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-            proc.communicate()
+    def getProcessOptions(self):
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
 
-        return None
+    def killProcess(self, proc):
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
 
-    def runOclgrindClLauncher(self, kernel, timeLimit, optimised = True):
-        oclgrindEnv = os.environ
-        oclgrindEnv['OCLGRIND_DIAGNOSTIC_OPTIONS'] = '-Wall'
-        oclgrindEnv['OCLGRIND_UNINITIALIZED'] = '1'
-        oclgrindEnv['OCLGRIND_DATA_RACES'] = '1'
-        oclgrindEnv['OCLGRIND_UNIFORM_WRITES'] = '1'
-        oclgrindEnv['OCLGRIND_STOP_ERRORS'] = '1'
-        args = ['-p', str(self.oclgrindPlatform), '-d', str(self.oclgrindDevice), '-f', kernel]
+    def getOclgrindCommand(self, kernel, optimised = True):
+        oclgrindEnv = dict(os.environ)
 
-        if not optimised:
-            args.append('---disable_opts')
+        for oclgrindArg in self.oclgrindArgs:
+            (name, value) = oclgrindArg.split('=', 1)
+            oclgrindEnv[name] = value
 
-        return self.check_output([self.clLauncher] + args, timeLimit, env=oclgrindEnv)
+        return (self.getKernelCommand(self.oclgrindPlatform, self.oclgrindDevice, kernel, optimised), oclgrindEnv)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Interestingness tests for OpenCL kernels.')
-    parser.add_argument('--test', choices=InterestingnessTest.availableTests, default=InterestingnessTest.availableTests[0], help='Interestingness test')
-    parser.add_argument('kernel', nargs='?', help='Filename of the OpenCL kernel')
+def configureOpenCLEnv(openCLEnv):
+    openCLEnv.deviceConcurrency = int(os.environ.get('CREDUCE_TEST_DEVICE_CONCURRENCY', 1))
+    openCLEnv.oclgrindConcurrency = int(os.environ.get('CREDUCE_TEST_OCLGRIND_CONCURRENCY', 1))
+    openCLEnv.captureLimit = int(os.environ.get('CREDUCE_TEST_CAPTURE_LIMIT', 1 << 20))
+    openCLEnv.oclgrindTiered = bool(os.environ.get('CREDUCE_TEST_OCLGRIND_TIERED'))
 
-    args = parser.parse_args()
+    memoryLimit = os.environ.get('CREDUCE_TEST_MEMORY_LIMIT')
+    cpuLimit = os.environ.get('CREDUCE_TEST_CPU_LIMIT')
 
-    kernelName = os.environ.get('CREDUCE_TEST_KERNEL', 'CLProg.cl')
+    if (memoryLimit or cpuLimit) and sys.platform != 'win32':
+        openCLEnv.resourceLimits = (int(memoryLimit) << 20 if memoryLimit else None, int(cpuLimit) if cpuLimit else None)
 
-    if args.kernel:
-        kernelName = args.kernel
+    if not os.environ.get('CREDUCE_TEST_NO_LOCK'):
+        openCLEnv.lockDir = os.environ.get('CREDUCE_TEST_LOCK_DIR', deviceLease.getDefaultLockDir())
 
-    testPlatform = os.environ.get('CREDUCE_TEST_PLATFORM')
+    if os.environ.get('CREDUCE_TEST_DEVICES'):
+        openCLEnv.devicePool = deviceLease.DevicePool(deviceLease.parseDevices(os.environ.get('CREDUCE_TEST_DEVICES')), openCLEnv.deviceConcurrency, openCLEnv.lockDir)
+
+    openCLEnv.pchDir = os.environ.get('CREDUCE_TEST_PCH_DIR')
+
+def getTestEnvironment():
+    # The first device of a pool is the default device under test
+    devices = deviceLease.parseDevices(os.environ.get('CREDUCE_TEST_DEVICES', ''))
+
+    testPlatform = os.environ.get('CREDUCE_TEST_PLATFORM', devices[0][0] if devices else None)
     if not testPlatform:
         print('CREDUCE_TEST_PLATFORM not defined!')
         sys.exit(1)
 
-    testDevice = os.environ.get('CREDUCE_TEST_DEVICE')
+    testDevice = os.environ.get('CREDUCE_TEST_DEVICE', devices[0][1] if devices else None)
     if not testDevice:
         print('CREDUCE_TEST_DEVICE not defined!')
         sys.exit(1)
@@ -459,14 +1313,6 @@ if __name__ == "__main__":
 
     libclcIncludePath = os.environ.get('CREDUCE_LIBCLC_INCLUDE_PATH')
 
-    outputFile = None
-    if os.environ.get('CREDUCE_TEST_LOG'):
-        outputFile = open('output.log', 'a');
-
-    progressFile = None
-    if os.environ.get('CREDUCE_TEST_DEBUG'):
-        progressFile = sys.stdout
-
     if sys.platform == 'win32':
         oclgrindPlatform = os.environ.get('CREDUCE_TEST_OCLGRIND_PLATFORM')
         if not oclgrindPlatform:
@@ -482,12 +1328,51 @@ if __name__ == "__main__":
     else:
         openCLEnv = UnixOpenCLEnv(clLauncher, clang, libclcIncludePath)
 
-    kernelTest = InterestingnessTest(args.test, openCLEnv, kernelName, testPlatform, testDevice, outputFile=outputFile, progressFile=progressFile)
+    configureOpenCLEnv(openCLEnv)
+
+    return (openCLEnv, testPlatform, testDevice)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Interestingness tests for OpenCL kernels.')
+    parser.add_argument('--test', choices=InterestingnessTest.availableTests, default=InterestingnessTest.availableTests[0], help='Interestingness test')
+    parser.add_argument('--calibrate', action='store_true', help='Measure the duration of each stage and store it as baseline for adaptive time limits')
+    parser.add_argument('kernel', nargs='?', help='Filename of the OpenCL kernel')
+
+    args = parser.parse_args()
+
+    kernelName = os.environ.get('CREDUCE_TEST_KERNEL', 'CLProg.cl')
+
+    if args.kernel:
+        kernelName = args.kernel
+
+    (openCLEnv, testPlatform, testDevice) = getTestEnvironment()
+
+    outputFile = None
+    if os.environ.get('CREDUCE_TEST_LOG'):
+        outputFile = AppendLog(getLogFileName())
+
+    progressFile = None
+    if os.environ.get('CREDUCE_TEST_DEBUG'):
+        progressFile = sys.stdout
+
+    cache = verdictCache.getVerdictCache()
+    timings = stageTimings.getStageTimings(stageTimings.getTimingsFileName(kernelName, os.environ.get('CREDUCE_TEST_TIMINGS')))
+
+    if args.calibrate:
+        timings.startCalibration()
+
+    kernelTest = InterestingnessTest(args.test, openCLEnv, kernelName, testPlatform, testDevice, outputFile=outputFile, progressFile=progressFile, cache=cache, timings=timings)
     isSuccessfulTest = kernelTest.runTest()
 
+    if args.calibrate:
+        timings.finishCalibration(kernelTest.getWorkItemCount())
+
     if outputFile:
         outputFile.close()
 
+    if cache:
+        cache.close()
+
     if not isSuccessfulTest:
         sys.exit(1)
     else:
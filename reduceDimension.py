@@ -1,124 +1,160 @@
 #!/usr/bin/env python3
 
-import sys, os, re, openCLTest
-
-def which(cmd):
-    if sys.platform == 'win32' and '.' not in cmd:
-        cmd += '.exe'
-
-    if os.access(cmd, os.F_OK):
-        return cmd
-
-    for path in os.environ["PATH"].split(os.pathsep):
-        if os.access(os.path.join(path, cmd), os.F_OK):
-            return os.path.join(path, cmd)
-
-    return None
+import sys, os, argparse, tempfile, concurrent.futures, openCLTest
 
 class DimensionReducer:
-    def __init__(self, kernelFile, kernelTest):
-        self.kernelFile = open(kernelFile, 'r+')
+    def __init__(self, kernelFile, kernelTest, probes = 1):
+        self.kernelFile = kernelFile
         self.kernelTest = kernelTest
-        kernelContent = self.kernelFile.read()
+        self.probes = max(probes, 1)
+        self.metaInformation = None
+
+        with open(kernelFile, 'r') as f:
+            kernelContent = f.read()
 
-        m = re.search('//(.*) -g ([0-9]+),([0-9]+),([0-9]+) -l ([0-9]+),([0-9]+),([0-9]+)\n', kernelContent)
+        m = openCLTest.dimensionHeaderRegex.search(kernelContent)
 
         if m:
             self.metaInformation = m.group(1)
-            self.origGlobalDimensions = (m.group(2), m.group(3), m.group(4))
-            self.origLocalDimensions = (m.group(5), m.group(6), m.group(7))
-            self.kernelContent = kernelContent.replace(m.group(0), '')
+            self.origGlobalDimensions = (int(m.group(2)), int(m.group(3)), int(m.group(4)))
+            self.origLocalDimensions = (int(m.group(5)), int(m.group(6)), int(m.group(7)))
+            self.kernelContent = kernelContent[:m.start()] + kernelContent[m.end():].split('\n', 1)[-1]
 
-    def __del__(self):
-        self.kernelFile.close()
+    def getKernelContent(self, globalDim, localDim):
+        return openCLTest.getDimensionHeader(self.metaInformation, globalDim, localDim) + self.kernelContent
 
-    def updateDimensions(self, globalDim, localDim):
-        tmpGlobalDim = [0] * len(globalDim)
+    def rewriteDimensions(self, globalDim, localDim):
+        tmpFileName = self.kernelFile + '.tmp'
 
-        for i in range(0, len(globalDim)):
-            gDim = globalDim[i]
-            lDim = localDim[i]
+        with open(tmpFileName, 'w') as f:
+            f.write(self.getKernelContent(globalDim, localDim))
 
-            while gDim % lDim != 0 and gDim <= self.globalDim[i]:
-                gDim += 1
+        os.replace(tmpFileName, self.kernelFile)
 
-            tmpGlobalDim[i] = gDim
+    def isInteresting(self, dimensions):
+        # Every probe works on its own copy of the kernel next to the original
+        (fd, probeFileName) = tempfile.mkstemp(prefix='_dim.', suffix='.cl', dir=os.path.dirname(os.path.abspath(self.kernelFile)))
 
-        return (tuple(tmpGlobalDim), localDim)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.getKernelContent(*dimensions))
 
-    def rewriteDimensions(self, globalDim, localDim):
-        self.kernelFile.seek(0)
-        self.kernelFile.truncate()
-        self.kernelFile.write("//%s -g %d,%d,%d -l %d,%d,%d\n" % (self.metaInformation, globalDim[0], globalDim[1], globalDim[2], localDim[0], localDim[1], localDim[2]))
-        self.kernelFile.write(self.kernelContent)
-        self.kernelFile.flush()
+            probeTest = self.kernelTest.copyForKernel(probeFileName)
 
-    def reduce(self, unchecked = False):
-        newGlobalDim = (1,1,1)
-        newLocalDim = (1,1,1)
+            try:
+                return probeTest.runTest()
+            finally:
+                probeTest.discardStageOutputs()
+        finally:
+            os.remove(probeFileName)
 
-        self.rewriteDimensions(newGlobalDim, newLocalDim)
+    def findSmallest(self, candidates, executor):
+        # The last candidate is known to be interesting, larger NDRanges are assumed to stay interesting
+        low = -1
+        high = len(candidates) - 1
 
-        if not unchecked:
-            while not self.kernelTest.runTest():
-                (gDim, lDim) = self.updateDimensions(newGlobalDim, newLocalDim)
+        while high - low > 1:
+            count = min(self.probes, high - low - 1)
+            indices = sorted(set(low + (high - low) * (i + 1) // (count + 1) for i in range(count)))
+            results = list(executor.map(self.isInteresting, [candidates[i] for i in indices]))
 
-                if gDim == newGlobalDim and lDim == newLocalDim:
-                    return None
-                else:
-                    newGlobalDim = gDim
-                    newLocalDim = lDim
+            for (index, result) in zip(indices, results):
+                if result:
+                    high = index
+                    break
 
-                self.rewriteDimensions(newGlobalDim, newLocalDim)
+                low = index
 
-        return (newGlobalDim, newLocalDim)
+        return candidates[high]
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('No file specified!')
-        sys.exit(1)
+    def jumpToDivergence(self):
+        if 'miscompiled' not in (self.kernelTest.testStages.get(self.kernelTest.test) or []):
+            return None
 
-    kernelFile = sys.argv[1]
+        divergentWorkItems = self.kernelTest.getDivergentWorkItems()
 
-    testPlatform = os.environ.get('CREDUCE_TEST_PLATFORM')
-    if not testPlatform:
-        print('CREDUCE_TEST_PLATFORM not defined!')
-        sys.exit(1)
+        if not divergentWorkItems:
+            return None
 
-    testDevice = os.environ.get('CREDUCE_TEST_DEVICE')
-    if not testDevice:
-        print('CREDUCE_TEST_DEVICE not defined!')
-        sys.exit(1)
+        # The smallest NDRange which still contains one of the divergent work-items
+        coordinates = [openCLTest.getWorkItemCoordinates(linearId, self.origGlobalDimensions) for linearId in divergentWorkItems]
+        (x, y, z) = min(coordinates, key=lambda c: (c[0] + 1) * (c[1] + 1) * (c[2] + 1))
 
-    clLauncher = os.environ.get('CREDUCE_TEST_CLLAUNCHER', os.path.abspath('./cl_launcher'))
-    if not which(clLauncher):
-        clLauncher = os.path.basename(clLauncher)
+        candidates = [((x + 1, y + 1, z + 1), (1, 1, 1))]
 
-        if not which(clLauncher):
-            print('CREDUCE_TEST_CLLAUNCHER not defined and cl_launcher not found!')
-            sys.exit(1)
+        # Keep the work-groups in case the miscompilation depends on them
+        localDim = self.origLocalDimensions
+        candidates.append((tuple(-(-(c + 1) // l) * l for (c, l) in zip((x, y, z), localDim)), localDim))
 
-    clang = os.environ.get('CREDUCE_TEST_CLANG', os.path.abspath('./clang'))
-    if not which(clang):
-        clang = os.path.basename(clang)
+        for candidate in candidates:
+            if self.isInteresting(candidate):
+                return candidate
 
-        if not which(clang):
-            print('CREDUCE_TEST_CLANG not defined and clang not found!')
-            sys.exit(1)
+        return None
 
-    libclcIncludePath = os.environ.get('CREDUCE_LIBCLC_INCLUDE_PATH')
+    def bisectDimensions(self, executor):
+        globalDim = list(self.origGlobalDimensions)
+        localDim = list(self.origLocalDimensions)
 
-    if sys.platform == 'win32':
-        openCLEnv = openCLTest.WinOpenCLEnv(clLauncher, clang, libclcIncludePath, 0, 0)
-    else:
-        openCLEnv = openCLTest.UnixOpenCLEnv(clLauncher, clang, libclcIncludePath)
+        for i in range(0, 3):
+            # Local sizes must divide the global size, global sizes must be multiples of the local size
+            candidates = []
+            for lDim in [d for d in range(1, localDim[i] + 1) if localDim[i] % d == 0]:
+                candidates.append((tuple(globalDim), tuple(localDim[:i] + [lDim] + localDim[i + 1:])))
+
+            localDim = list(self.findSmallest(candidates, executor)[1])
+
+            candidates = []
+            for gDim in range(localDim[i], globalDim[i] + 1, localDim[i]):
+                candidates.append((tuple(globalDim[:i] + [gDim] + globalDim[i + 1:]), tuple(localDim)))
+
+            globalDim = list(self.findSmallest(candidates, executor)[0])
+
+        return (tuple(globalDim), tuple(localDim))
+
+    def reduce(self, unchecked = False):
+        if self.metaInformation is None:
+            return None
+
+        newGlobalDim = (1,1,1)
+        newLocalDim = (1,1,1)
+
+        if unchecked:
+            self.rewriteDimensions(newGlobalDim, newLocalDim)
+            return (newGlobalDim, newLocalDim)
+
+        with concurrent.futures.ThreadPoolExecutor(self.probes) as executor:
+            if not self.isInteresting((newGlobalDim, newLocalDim)):
+                dimensions = self.jumpToDivergence()
+
+                if dimensions is None:
+                    dimensions = self.bisectDimensions(executor)
+
+                (newGlobalDim, newLocalDim) = dimensions
+
+        if newGlobalDim == self.origGlobalDimensions and newLocalDim == self.origLocalDimensions:
+            return None
+
+        self.rewriteDimensions(newGlobalDim, newLocalDim)
+
+        return (newGlobalDim, newLocalDim)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reduce the NDRange of an OpenCL kernel while it stays interesting.')
+    parser.add_argument('--test', choices=openCLTest.InterestingnessTest.availableTests, default=openCLTest.InterestingnessTest.availableTests[0], help='Interestingness test')
+    parser.add_argument('--probes', type=int, metavar='NUM', default=1, help='Number of NDRanges which are tested in parallel (default: 1)')
+    parser.add_argument('kernel', help='Filename of the OpenCL kernel')
+
+    args = parser.parse_args()
+
+    (openCLEnv, testPlatform, testDevice) = openCLTest.getTestEnvironment()
 
-    kernelTest = openCLTest.InterestingnessTest(openCLEnv, kernelFile, testPlatform, testDevice)
-    dimReducer = DimensionReducer(kernelFile, kernelTest)
+    kernelTest = openCLTest.InterestingnessTest(args.test, openCLEnv, args.kernel, testPlatform, testDevice)
+    dimReducer = DimensionReducer(args.kernel, kernelTest, args.probes)
     result = dimReducer.reduce()
 
     if not result:
-        print("File cannot be miscompiled!")
+        print("Dimensions cannot be reduced!")
         sys.exit(1)
     else:
         print('Reduced dimensions to %s' % str(result))
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import sys, os, argparse, tempfile, hashlib, multiprocessing, concurrent.futures
+import openCLTest, verdictCache, stageTimings
+
+availablePasses = ['blocks', 'lines', 'tokens']
+
+# Interestingness test of a worker process
+workerTest = None
+
+def initWorker(kernelTest):
+    global workerTest
+    workerTest = kernelTest
+
+def evaluateCandidate(kernelDir, kernelContent, kernelTest = None):
+    # Every candidate is tested on its own file next to the original kernel
+    (fd, candidateFileName) = tempfile.mkstemp(prefix='_reduce.', suffix='.cl', dir=kernelDir)
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(kernelContent)
+
+        candidateTest = (kernelTest or workerTest).copyForKernel(candidateFileName)
+
+        try:
+            return candidateTest.runTest()
+        finally:
+            candidateTest.discardStageOutputs()
+    finally:
+        os.remove(candidateFileName)
+
+def splitLines(body):
+    return body.splitlines(keepends=True)
+
+def splitTokens(body):
+    # Each token keeps the whitespace which follows it
+    units = []
+    position = 0
+
+    for m in openCLTest.kernelTokenRegex.finditer(body):
+        if m.start() > position and not units:
+            units.append(body[position:m.start()])
+        elif m.start() > position:
+            units[-1] += body[position:m.start()]
+
+        units.append(m.group(0))
+        position = m.end()
+
+    if position < len(body):
+        if units:
+            units[-1] += body[position:]
+        else:
+            units.append(body[position:])
+
+    return units
+
+def getLineBraces(body):
+    # Braces in comments, literals and preprocessor directives are not counted
+    lines = splitLines(body)
+    braces = [[0, 0] for line in lines]
+    lineIndex = 0
+    lineEnd = len(lines[0]) if lines else 0
+
+    for m in openCLTest.kernelTokenRegex.finditer(body):
+        if m.group(0) not in '{}':
+            continue
+
+        while m.start() >= lineEnd:
+            lineIndex += 1
+            lineEnd += len(lines[lineIndex])
+
+        braces[lineIndex][m.group(0) == '}'] += 1
+
+    return zip(lines, braces)
+
+def splitBlocks(body, depth):
+    # Lines which open a brace block at the given depth are grouped with the rest of the block
+    units = []
+    currentDepth = 0
+    blockDepth = None
+
+    for (line, (opening, closing)) in getLineBraces(body):
+        if blockDepth is not None:
+            units[-1] += line
+        else:
+            units.append(line)
+
+            if currentDepth == depth and opening > closing:
+                blockDepth = currentDepth
+
+        currentDepth += opening - closing
+
+        if blockDepth is not None and currentDepth <= blockDepth:
+            blockDepth = None
+
+    return units
+
+class KernelReducer:
+    def __init__(self, kernelFile, kernelTest, jobs = 1, passes = availablePasses, progressFile = None):
+        self.kernelFile = kernelFile
+        self.kernelTest = kernelTest
+        self.jobs = max(jobs, 1)
+        self.passes = passes
+        self.progressFile = progressFile
+        self.verdicts = {}
+        self.executor = None
+
+        with open(kernelFile, 'r') as f:
+            kernelContent = f.read()
+
+        # The NDRange header is never removed
+        m = openCLTest.dimensionHeaderRegex.match(kernelContent)
+
+        if m:
+            headerEnd = kernelContent.find('\n', m.end()) + 1 or len(kernelContent)
+            self.header = kernelContent[:headerEnd]
+            self.body = kernelContent[headerEnd:]
+        else:
+            self.header = ''
+            self.body = kernelContent
+
+    def logProgress(self, msg):
+        if self.progressFile:
+            print(msg, file=self.progressFile)
+
+    def writeKernel(self):
+        tmpFileName = self.kernelFile + '.tmp'
+
+        with open(tmpFileName, 'w') as f:
+            f.write(self.header + self.body)
+
+        os.replace(tmpFileName, self.kernelFile)
+
+    def areInteresting(self, bodies):
+        kernelDir = os.path.dirname(os.path.abspath(self.kernelFile))
+        results = [None] * len(bodies)
+        pending = {}
+
+        for (index, body) in enumerate(bodies):
+            kernelContent = self.header + body
+            key = hashlib.sha1(kernelContent.encode()).digest()
+
+            # Identical variants are tested once, broken ones are not tested at all
+            if key in self.verdicts:
+                results[index] = self.verdicts[key]
+            elif openCLTest.scanKernel(kernelContent).isBalanced is False:
+                results[index] = self.verdicts[key] = False
+            else:
+                pending[index] = (key, kernelContent)
+
+        if self.executor is None:
+            for (index, (key, kernelContent)) in pending.items():
+                results[index] = self.verdicts[key] = evaluateCandidate(kernelDir, kernelContent, self.kernelTest)
+        else:
+            futures = {index: self.executor.submit(evaluateCandidate, kernelDir, kernelContent) for (index, (key, kernelContent)) in pending.items()}
+
+            for (index, future) in futures.items():
+                results[index] = self.verdicts[pending[index][0]] = future.result()
+
+        return results
+
+    def ddmin(self, units):
+        granularity = 2
+
+        while len(units) >= 2:
+            chunkSize = -(-len(units) // granularity)
+            complements = [units[:start] + units[start + chunkSize:] for start in range(0, len(units), chunkSize)]
+            reduced = None
+
+            # Candidates are tested in batches, the first interesting one in order wins
+            for batchStart in range(0, len(complements), self.jobs):
+                batch = complements[batchStart:batchStart + self.jobs]
+                results = self.areInteresting([''.join(complement) for complement in batch])
+
+                if True in results:
+                    reduced = batch[results.index(True)]
+                    break
+
+            if reduced is not None:
+                units = reduced
+                granularity = max(granularity - 1, 2)
+                self.body = ''.join(units)
+                self.writeKernel()
+            elif granularity >= len(units):
+                break
+            else:
+                granularity = min(granularity * 2, len(units))
+
+        return units
+
+    def getMaximumDepth(self):
+        depth = 0
+        maximumDepth = 0
+
+        for (line, (opening, closing)) in getLineBraces(self.body):
+            depth += opening - closing
+            maximumDepth = max(maximumDepth, depth)
+
+        return maximumDepth
+
+    def runPass(self, name):
+        if name == 'blocks':
+            depth = 0
+
+            while depth <= self.getMaximumDepth():
+                units = splitBlocks(self.body, depth)
+                self.logProgress('Pass blocks at depth %d: %d units' % (depth, len(units)))
+                self.ddmin(units)
+                depth += 1
+        elif name == 'lines':
+            units = splitLines(self.body)
+            self.logProgress('Pass lines: %d units' % len(units))
+            self.ddmin(units)
+        elif name == 'tokens':
+            units = splitTokens(self.body)
+            self.logProgress('Pass tokens: %d units' % len(units))
+            self.ddmin(units)
+
+    def reduce(self):
+        origBody = self.body
+
+        if self.jobs > 1:
+            # Output files cannot be shared with the worker processes
+            kernelTest = self.kernelTest.copyForKernel(self.kernelFile)
+            kernelTest.outputFile = None
+            kernelTest.progressFile = None
+            # Forked workers would inherit the device semaphores of the campaign threads in whatever state they are
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs, mp_context=multiprocessing.get_context('spawn'), initializer=initWorker, initargs=(kernelTest,))
+
+        try:
+            # Repeat the passes until they reach a fixpoint
+            while True:
+                size = len(self.body)
+
+                for name in self.passes:
+                    self.runPass(name)
+
+                if len(self.body) >= size:
+                    break
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+        return self.body != origBody
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reduce an OpenCL kernel with delta debugging while it stays interesting.')
+    parser.add_argument('--test', choices=openCLTest.InterestingnessTest.availableTests, default=openCLTest.InterestingnessTest.availableTests[0], help='Interestingness test')
+    parser.add_argument('--jobs', '-j', type=int, metavar='NUM', default=1, help='Number of variants which are tested in parallel (default: 1)')
+    parser.add_argument('--passes', nargs='+', choices=availablePasses, default=availablePasses, help='Reduction passes in the order in which they are run')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
+    parser.add_argument('kernel', help='Filename of the OpenCL kernel')
+
+    args = parser.parse_args()
+
+    (openCLEnv, testPlatform, testDevice) = openCLTest.getTestEnvironment()
+
+    timings = stageTimings.getStageTimings(stageTimings.getTimingsFileName(args.kernel, os.environ.get('CREDUCE_TEST_TIMINGS')))
+
+    cache = verdictCache.getVerdictCache()
+    kernelTest = openCLTest.InterestingnessTest(args.test, openCLEnv, args.kernel, testPlatform, testDevice, cache=cache, timings=timings)
+
+    if not kernelTest.runTest():
+        print('Kernel is not interesting!')
+        sys.exit(1)
+
+    origSize = os.path.getsize(args.kernel)
+    reducer = KernelReducer(args.kernel, kernelTest, args.jobs, args.passes, sys.stdout if args.verbose else None)
+    reducer.reduce()
+
+    if cache:
+        cache.close()
+
+    print('Reduced kernel from %d to %d bytes' % (origSize, os.path.getsize(args.kernel)))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os, json
+
+class StageTimings:
+    def __init__(self, fileName, factor = 10, minimum = 5, maximum = 300, scaleWorkItems = False):
+        self.fileName = os.path.abspath(fileName)
+        self.factor = factor
+        self.minimum = minimum
+        self.maximum = maximum
+        self.scaleWorkItems = scaleWorkItems
+        self.calibrating = False
+        self.timings = {}
+        self.workItemCount = None
+
+    def load(self):
+        try:
+            with open(self.fileName, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.timings = data.get('timings', {})
+        self.workItemCount = data.get('workItemCount')
+
+        return True
+
+    def save(self):
+        tmpFileName = self.fileName + '.tmp'
+
+        with open(tmpFileName, 'w') as f:
+            json.dump({'timings': self.timings, 'workItemCount': self.workItemCount}, f, indent=2, sort_keys=True)
+
+        os.replace(tmpFileName, self.fileName)
+
+    def startCalibration(self):
+        # Measurements of an earlier calibration are discarded
+        self.calibrating = True
+        self.timings = {}
+        self.workItemCount = None
+
+    def finishCalibration(self, workItemCount):
+        self.workItemCount = workItemCount
+        self.calibrating = False
+        self.save()
+
+    def record(self, stage, seconds):
+        self.timings[stage] = max(seconds, self.timings.get(stage, 0))
+
+    def getTimeLimit(self, stage, workItemCount = None):
+        # Calibration runs have to measure the real duration
+        if self.calibrating or stage not in self.timings:
+            return self.maximum
+
+        timeLimit = self.factor * self.timings[stage]
+
+        if self.scaleWorkItems and workItemCount and self.workItemCount:
+            timeLimit *= workItemCount / self.workItemCount
+
+        return min(max(timeLimit, self.minimum), self.maximum)
+
+    def getConfiguration(self):
+        if self.calibrating:
+            return None
+
+        return [self.timings, self.workItemCount, self.factor, self.minimum, self.maximum, self.scaleWorkItems]
+
+timingsVariables = ['CREDUCE_TEST_TIMEOUT_FACTOR', 'CREDUCE_TEST_TIMEOUT_MIN', 'CREDUCE_TEST_TIMEOUT_MAX', 'CREDUCE_TEST_TIMEOUT_SCALE_WORK_ITEMS']
+
+def getTimingsFileName(kernelName, timingsFile = None):
+    # Stored next to the kernel unless another file is given, e.g. with CREDUCE_TEST_TIMINGS
+    return timingsFile or kernelName + '.timings'
+
+def getStageTimings(timingsFile):
+    timings = StageTimings(timingsFile,
+                           float(os.environ.get('CREDUCE_TEST_TIMEOUT_FACTOR', 10)),
+                           float(os.environ.get('CREDUCE_TEST_TIMEOUT_MIN', 5)),
+                           float(os.environ.get('CREDUCE_TEST_TIMEOUT_MAX', 300)),
+                           bool(os.environ.get('CREDUCE_TEST_TIMEOUT_SCALE_WORK_ITEMS')))
+    timings.load()
+
+    return timings
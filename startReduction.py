@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse, os, sys, subprocess
+import openCLTest, reduceKernel, verdictCache
 
 def which(cmd):
     if sys.platform == 'win32' and '.' not in cmd:
@@ -18,14 +19,19 @@ def which(cmd):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Start C-Reduce for OpenCL kernel.')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
+    parser.add_argument('-n', metavar='NUM', type=int, default=1, help='Number of parallel C-Reduce workers (default: 1)')
     parser.add_argument('--platform', '-p', help='Platform under test')
     parser.add_argument('--device', '-d', help='Device under test')
+    parser.add_argument('--devices', nargs='+', metavar='PLATFORM:DEVICE', help='Equivalent devices across which the kernel runs are distributed')
     parser.add_argument('--cl-launcher', help='Path to cl_launcher application')
     parser.add_argument('--clang', help='Path to clang application')
     parser.add_argument('--libclc', help='Path to libclc include directory')
     if sys.platform == 'win32':
         parser.add_argument('--oclgrind-platform', help='Platform for Oclgrind')
         parser.add_argument('--oclgrind-device', help='Device for Oclgrind')
+    parser.add_argument('--native', metavar='TEST', choices=openCLTest.InterestingnessTest.availableTests, help='Reduce with the built-in delta debugging reducer and TEST before C-Reduce')
+    parser.add_argument('--native-only', dest='nativeOnly', action='store_true', help='Skip C-Reduce after the built-in reducer')
+    parser.add_argument('--jobs', '-j', type=int, metavar='NUM', default=1, help='Number of variants tested in parallel by the built-in reducer (default: 1)')
     parser.add_argument('test', nargs=1, help='Test script')
     parser.add_argument('kernel', nargs=1, help='OpenCL kernel')
 
@@ -33,14 +39,17 @@ if __name__ == '__main__':
 
     env = os.environ
 
+    if args.devices:
+        env['CREDUCE_TEST_DEVICES'] = ','.join(args.devices)
+
     if not args.platform:
-        if not env.get('CREDUCE_TEST_PLATFORM'):
+        if not env.get('CREDUCE_TEST_PLATFORM') and not env.get('CREDUCE_TEST_DEVICES'):
             parser.error('No platform specified and CREDUCE_TEST_PLATFORM not defined!')
     else:
         env['CREDUCE_TEST_PLATFORM'] = args.platform
 
     if not args.device:
-        if not env.get('CREDUCE_TEST_DEVICE'):
+        if not env.get('CREDUCE_TEST_DEVICE') and not env.get('CREDUCE_TEST_DEVICES'):
             parser.error('No device specified and CREDUCE_TEST_DEVICE not defined!')
     else:
         env['CREDUCE_TEST_DEVICE'] = args.device
@@ -81,12 +90,26 @@ if __name__ == '__main__':
         else:
             env['CREDUCE_TEST_OCLGRIND_DEVICE'] = args.oclgrind_device
 
+    if args.native:
+        (openCLEnv, testPlatform, testDevice) = openCLTest.getTestEnvironment()
+        cache = verdictCache.getVerdictCache()
+
+        kernelTest = openCLTest.InterestingnessTest(args.native, openCLEnv, args.kernel[0], testPlatform, testDevice, cache=cache)
+        reducer = reduceKernel.KernelReducer(args.kernel[0], kernelTest, args.jobs, progressFile=sys.stdout if args.verbose else None)
+        reducer.reduce()
+
+        if cache:
+            cache.close()
+
+        if args.nativeOnly:
+            sys.exit(0)
+
     if sys.platform == 'win32':
         creduceArgs = ['perl', '--', which('creduce.pl')]
     else:
         creduceArgs = ['creduce']
 
-    creduceArgs.extend(['-n', '1'])
+    creduceArgs.extend(['-n', str(args.n)])
 
     if args.verbose:
         creduceArgs.append('--verbose')
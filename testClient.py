@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+# Keep the imports minimal, the client is started for every variant
+import os, sys, socket
+
+if __name__ == '__main__':
+    test = 'miscompilation'
+    kernelName = os.environ.get('CREDUCE_TEST_KERNEL', 'CLProg.cl')
+    args = sys.argv[1:]
+
+    while args:
+        arg = args.pop(0)
+
+        if arg == '--test' and args:
+            test = args.pop(0)
+        elif arg.startswith('--test='):
+            test = arg[len('--test='):]
+        else:
+            kernelName = arg
+
+    request = '%s\t%s\t%s\n' % (test, os.path.abspath(kernelName), os.environ.get('CREDUCE_TEST_TIMINGS', ''))
+
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(os.environ['CREDUCE_TEST_SOCKET'])
+        client.sendall(request.encode())
+        response = client.makefile('rb').readline()
+        client.close()
+    except (KeyError, OSError):
+        response = b''
+
+    if not response:
+        # Fall back to a standalone test if the server is not available
+        openCLTest = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openCLTest.py')
+        os.execv(sys.executable, [sys.executable, openCLTest] + sys.argv[1:])
+
+    sys.exit(int(response))
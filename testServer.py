@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse, os, sys, signal, socketserver, threading, concurrent.futures
+import openCLTest, verdictCache, stageTimings
+
+class TestRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Request: test, kernel and optional timings file separated by tabs
+        request = self.rfile.readline().decode().rstrip('\n').split('\t')
+
+        try:
+            exitCode = self.server.runTest(*request)
+        except Exception as err:
+            print('Test failed: %s' % err, file=sys.stderr)
+            exitCode = 1
+
+        self.wfile.write(b'%d\n' % exitCode)
+
+class InterestingnessServer(socketserver.UnixStreamServer):
+    def __init__(self, socketName, openCLEnv, testPlatform, testDevice, outputFile = None, progressFile = None, cache = None, workers = None):
+        super().__init__(socketName, TestRequestHandler)
+
+        # Worker threads are reused, hence their cache connections persist between requests
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count() or 1)
+
+        self.openCLEnv = openCLEnv
+        self.testPlatform = testPlatform
+        self.testDevice = testDevice
+        self.outputFile = outputFile
+        self.progressFile = progressFile
+        self.cache = cache
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.processRequest, request, client_address)
+
+    def processRequest(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def runTest(self, test, kernelName, timingsFile = ''):
+        if test not in openCLTest.InterestingnessTest.availableTests:
+            return 1
+
+        # Same default as a standalone test, the client forwards its CREDUCE_TEST_TIMINGS
+        timings = stageTimings.getStageTimings(stageTimings.getTimingsFileName(kernelName, timingsFile))
+
+        kernelTest = openCLTest.InterestingnessTest(test, self.openCLEnv, kernelName, self.testPlatform, self.testDevice, outputFile=self.outputFile, progressFile=self.progressFile, cache=self.cache, timings=timings)
+
+        if not kernelTest.runTest():
+            return 1
+
+        return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve interestingness tests for OpenCL kernels over a Unix socket.')
+    parser.add_argument('--socket', default=os.environ.get('CREDUCE_TEST_SOCKET'), help='Path of the Unix socket (default: CREDUCE_TEST_SOCKET)')
+    parser.add_argument('--workers', type=int, metavar='NUM', default=os.cpu_count() or 1, help='Number of tests which are evaluated in parallel (default: number of CPUs)')
+
+    args = parser.parse_args()
+
+    if not args.socket:
+        parser.error('No socket specified and CREDUCE_TEST_SOCKET not defined!')
+
+    if sys.platform == 'win32':
+        parser.error('Unix sockets are not supported on Windows!')
+
+    (openCLEnv, testPlatform, testDevice) = openCLTest.getTestEnvironment()
+
+    outputFile = None
+    if os.environ.get('CREDUCE_TEST_LOG'):
+        outputFile = openCLTest.AppendLog(openCLTest.getLogFileName())
+
+    progressFile = None
+    if os.environ.get('CREDUCE_TEST_DEBUG'):
+        progressFile = sys.stdout
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    server = InterestingnessServer(args.socket, openCLEnv, testPlatform, testDevice, outputFile, progressFile, verdictCache.getVerdictCache(), args.workers)
+
+    # Shut down cleanly when the reduction is finished
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+        if outputFile:
+            outputFile.close()
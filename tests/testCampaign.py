@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import os, sys, argparse, tempfile, shutil, unittest, unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openCLTest, campaignCheckpoints, bugSignatures, findMiscompilations
+
+class FakeTest:
+    def discardStageOutputs(self):
+        pass
+
+class CampaignTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.checkpoints = campaignCheckpoints.CheckpointStore(os.path.join(self.tmpDir, 'checkpoints.sqlite'))
+        self.signatures = bugSignatures.SignatureIndex(os.path.join(self.tmpDir, 'signatures.sqlite'))
+
+        args = argparse.Namespace(test='miscompilation', duplicates='skip', adaptiveTimeouts=False, verbose=False, n=None, reduceDimension=None, dimensionProbes=1)
+        openCLEnv = openCLTest.UnixOpenCLEnv('cl_launcher', 'clang', self.tmpDir)
+        self.campaign = findMiscompilations.Campaign(args, openCLEnv, 0, 0, 'clang', None, self.tmpDir, 10, checkpoints=self.checkpoints, signatures=self.signatures)
+
+    def tearDown(self):
+        self.checkpoints.close()
+        self.signatures.close()
+        shutil.rmtree(self.tmpDir)
+
+    def writeKernel(self, name, content):
+        kernelFile = os.path.join(self.tmpDir, name)
+
+        with open(kernelFile, 'w') as f:
+            f.write(content)
+
+        return kernelFile
+
+class CheckpointResumeTest(CampaignTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.kernelFile = self.writeKernel('k.cl', 'kernel void entry(global ulong *result) { result[0] = 1; }\n')
+
+    def checkKernel(self, job):
+        self.calls.append('check')
+        return True
+
+    def reduceKernel(self, job):
+        self.calls.append('native-reduce')
+        self.writeKernel('k.cl', 'kernel void entry(global ulong *result) { }\n')
+        return True
+
+    def runStages(self, resuming):
+        job = findMiscompilations.KernelJob(self.kernelFile, resuming=resuming)
+        results = [self.campaign.runCheckpointedStage('check', self.checkKernel, job), self.campaign.runCheckpointedStage('native-reduce', self.reduceKernel, job)]
+        return (job, results)
+
+    def test_resume_completed_stages(self):
+        self.runStages(False)
+        self.calls = []
+
+        (job, results) = self.runStages(True)
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.calls, [])
+        self.assertTrue(job.resuming)
+
+    def test_resume_after_interrupted_stage(self):
+        self.runStages(False)
+        self.checkpoints.connect().execute("DELETE FROM checkpoints WHERE stage = 'native-reduce'")
+        self.calls = []
+
+        (job, results) = self.runStages(True)
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.calls, ['native-reduce'])
+        self.assertFalse(job.resuming)
+
+    def test_changed_configuration(self):
+        self.runStages(False)
+        self.calls = []
+        self.campaign.args.n = 4
+
+        self.runStages(True)
+
+        self.assertEqual(self.calls, ['native-reduce'])
+
+    def test_failed_stage(self):
+        job = findMiscompilations.KernelJob(self.kernelFile)
+        self.assertFalse(self.campaign.runCheckpointedStage('check', lambda job: False, job))
+
+        resumedJob = findMiscompilations.KernelJob(self.kernelFile, resuming=True)
+        self.assertFalse(self.campaign.runCheckpointedStage('check', self.checkKernel, resumedJob))
+        self.assertEqual(self.calls, [])
+
+class SignatureResumeTest(CampaignTestCase):
+    def signKernel(self, job):
+        job.kernelTest = FakeTest()
+
+        with unittest.mock.patch.object(bugSignatures, 'getSignature', return_value='miscompilation:0123456789abcdef'):
+            return self.campaign.runCheckpointedStage('signature', self.campaign.signKernel, job)
+
+    def test_resume_after_partial_reduction(self):
+        kernelFile = self.writeKernel('k.cl', 'kernel void entry(global ulong *result) { result[0] = 1; }\n')
+        job = findMiscompilations.KernelJob(kernelFile)
+
+        self.assertTrue(self.signKernel(job))
+        self.assertTrue(self.campaign.filterDuplicate(job))
+
+        # Interrupted after the reduction has rewritten the kernel
+        self.writeKernel('k.cl', 'kernel void entry(global ulong *result) { }\n')
+
+        resumedJob = findMiscompilations.KernelJob(kernelFile, resuming=True)
+
+        self.assertTrue(self.signKernel(resumedJob))
+        self.assertTrue(resumedJob.resuming)
+        self.assertEqual(resumedJob.signedHash, job.signedHash)
+        self.assertTrue(self.campaign.filterDuplicate(resumedJob))
+
+    def test_duplicate_signature(self):
+        firstJob = findMiscompilations.KernelJob(self.writeKernel('k.cl', 'kernel void entry(global ulong *result) { result[0] = 1; }\n'))
+        secondJob = findMiscompilations.KernelJob(self.writeKernel('s.cl', 'kernel void entry(global ulong *result) { result[0] = 2; }\n'))
+
+        self.assertTrue(self.signKernel(firstJob))
+        self.assertTrue(self.signKernel(secondJob))
+        self.assertTrue(self.campaign.filterDuplicate(firstJob))
+        self.assertFalse(self.campaign.filterDuplicate(secondJob))
+
+        # Registering again gives the same answer
+        self.assertTrue(self.campaign.filterDuplicate(firstJob))
+        self.assertFalse(self.campaign.filterDuplicate(secondJob))
+
+if __name__ == '__main__':
+    unittest.main()
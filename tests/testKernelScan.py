@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openCLTest
+
+class KernelScanTest(unittest.TestCase):
+    def test_balanced(self):
+        self.assertIs(openCLTest.KernelScan('kernel void entry(global ulong *result) { /* } */ char c = \'}\'; }\n').isBalanced, True)
+
+    def test_unbalanced(self):
+        self.assertIs(openCLTest.KernelScan('kernel void entry(global ulong *result) { if (1) { }\n').isBalanced, False)
+        self.assertIs(openCLTest.KernelScan('kernel void entry(global ulong *result) { /* }\n').isBalanced, False)
+
+    def test_macro_brackets(self):
+        # Only known after preprocessing, hence not rejected
+        kernelScan = openCLTest.KernelScan('#define BEGIN {\n#define END }\nkernel void entry(global ulong *result) BEGIN result[0] = 1; }\n')
+
+        self.assertIsNone(kernelScan.isBalanced)
+        self.assertIs(openCLTest.KernelScan('#define ADD(a, b) ((a) + (b))\nkernel void entry(global ulong *result) { }\n').isBalanced, True)
+
+    def test_result_access(self):
+        self.assertTrue(openCLTest.KernelScan('kernel void entry(global ulong *result) { result[get_linear_global_id()] = 1; }\n').hasValidResultAccess)
+        self.assertFalse(openCLTest.KernelScan('kernel void entry(global ulong *result) { result[0] = 1; }\n').hasValidResultAccess)
+        self.assertTrue(openCLTest.KernelScan('kernel void entry(global ulong *result) { /* result[0] */ }\n').hasValidResultAccess)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os, sys, tempfile, shutil, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openCLTest, reduceDimension
+
+class NDRangeTest:
+    # Interesting if the NDRange of the probe satisfies the predicate, no tool is run
+    test = 'valid'
+    testStages = openCLTest.InterestingnessTest.testStages
+
+    def __init__(self, predicate, kernelName = None, probes = None):
+        self.predicate = predicate
+        self.kernelName = kernelName
+        self.probes = probes if probes is not None else []
+
+    def copyForKernel(self, kernelName):
+        return NDRangeTest(self.predicate, kernelName, self.probes)
+
+    def runTest(self):
+        with open(self.kernelName, 'r') as f:
+            kernelScan = openCLTest.KernelScan(f.read())
+
+        self.probes.append((kernelScan.globalDimensions, kernelScan.localDimensions))
+        return self.predicate(kernelScan.globalDimensions, kernelScan.localDimensions)
+
+    def discardStageOutputs(self):
+        pass
+
+class DimensionReducerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.kernelFile = os.path.join(self.tmpDir, 'k.cl')
+
+        with open(self.kernelFile, 'w') as f:
+            f.write(openCLTest.getDimensionHeader(' Seed: 1', (64, 2, 1), (8, 2, 1)) + 'kernel void entry(global ulong *result) { }\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def reduce(self, predicate, probes = 1):
+        kernelTest = NDRangeTest(predicate)
+        result = reduceDimension.DimensionReducer(self.kernelFile, kernelTest, probes).reduce()
+        return (result, kernelTest.probes)
+
+    def readDimensions(self):
+        with open(self.kernelFile, 'r') as f:
+            kernelScan = openCLTest.KernelScan(f.read())
+
+        return (kernelScan.globalDimensions, kernelScan.localDimensions)
+
+    def test_bisection(self):
+        (result, probes) = self.reduce(lambda globalDim, localDim: globalDim[0] >= 24 and localDim[0] >= 4)
+
+        self.assertEqual(result, ((24, 1, 1), (4, 1, 1)))
+        self.assertEqual(self.readDimensions(), result)
+        # Bisection instead of a linear scan over the 16 global sizes of the first dimension
+        self.assertLess(len(probes), 16)
+        self.assertEqual(os.listdir(self.tmpDir), ['k.cl'])
+
+    def test_parallel_probes(self):
+        (result, probes) = self.reduce(lambda globalDim, localDim: globalDim[0] >= 24 and localDim[0] >= 4, probes=3)
+
+        self.assertEqual(result, ((24, 1, 1), (4, 1, 1)))
+
+    def test_single_work_item(self):
+        (result, probes) = self.reduce(lambda globalDim, localDim: True)
+
+        self.assertEqual(result, ((1, 1, 1), (1, 1, 1)))
+        self.assertEqual(len(probes), 1)
+
+    def test_not_reducible(self):
+        (result, probes) = self.reduce(lambda globalDim, localDim: globalDim == (64, 2, 1) and localDim == (8, 2, 1))
+
+        self.assertIsNone(result)
+        self.assertEqual(self.readDimensions(), ((64, 2, 1), (8, 2, 1)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os, sys, tempfile, shutil, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openCLTest, verdictCache
+
+class CountingTest(openCLTest.InterestingnessTest):
+    # Evaluation without any tool, the verdict and the incomplete stages are set by the test case
+    verdict = True
+    incomplete = set()
+    evaluations = 0
+
+    def evaluateTest(self):
+        type(self).evaluations += 1
+        self.incompleteStages = set(self.incomplete)
+        return self.verdict
+
+class VerdictCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cache = verdictCache.VerdictCache(os.path.join(self.tmpDir, 'cache.sqlite'))
+        self.openCLEnv = openCLTest.UnixOpenCLEnv('cl_launcher', 'clang', self.tmpDir)
+        self.kernelName = os.path.join(self.tmpDir, 'k.cl')
+        self.writeKernel('kernel void entry(global ulong *result) { }\n')
+
+        CountingTest.verdict = True
+        CountingTest.incomplete = set()
+        CountingTest.evaluations = 0
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpDir)
+
+    def writeKernel(self, content):
+        with open(self.kernelName, 'w') as f:
+            f.write(content)
+
+    def runTest(self, test = 'miscompilation'):
+        return CountingTest(test, self.openCLEnv, self.kernelName, 0, 0, cache=self.cache).runTest()
+
+    def test_hit(self):
+        self.assertTrue(self.runTest())
+        CountingTest.verdict = False
+
+        self.assertTrue(self.runTest())
+        self.assertEqual(CountingTest.evaluations, 1)
+
+    def test_miss_on_other_kernel_or_test(self):
+        self.runTest()
+        self.writeKernel('kernel void entry(global ulong *result) { result[0] = 1; }\n')
+        self.runTest()
+        self.runTest('valid')
+
+        self.assertEqual(CountingTest.evaluations, 3)
+
+    def test_incomplete_not_cached(self):
+        # A timed-out tool stage depends on the load, the verdict is evaluated again
+        CountingTest.incomplete = {'oclgrind-optimised'}
+        self.runTest()
+        self.runTest()
+
+        self.assertEqual(CountingTest.evaluations, 2)
+
+    def test_eviction(self):
+        cache = verdictCache.VerdictCache(os.path.join(self.tmpDir, 'small.sqlite'), maxEntries=10, evictionInterval=1)
+        keys = ['%064x' % index for index in range(30)]
+
+        for key in keys:
+            cache.put(key, True)
+
+        count = cache.connect().execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+
+        self.assertLessEqual(count, 10)
+        self.assertTrue(cache.get(keys[-1]))
+        self.assertIsNone(cache.get(keys[0]))
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os, time, json, hashlib, sqlite3, threading
+
+class VerdictCache:
+    def __init__(self, fileName, maxEntries = 100000, evictionInterval = 256):
+        self.fileName = os.path.abspath(fileName)
+        self.maxEntries = maxEntries
+        self.evictionInterval = evictionInterval
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # Connections cannot be shared between processes or threads
+        state = self.__dict__.copy()
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            # Autocommit mode, transactions are started explicitly
+            connection = sqlite3.connect(self.fileName, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict INTEGER NOT NULL, lastUsed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS verdictsLastUsed ON verdicts (lastUsed)')
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    @staticmethod
+    def getKey(kernelContent, test, platform, device, configuration):
+        keyHash = hashlib.sha256()
+        keyHash.update(hashlib.sha256(kernelContent.encode()).digest())
+        keyHash.update(json.dumps([test, platform, device, configuration], sort_keys=True).encode())
+        return keyHash.hexdigest()
+
+    def get(self, key):
+        try:
+            connection = self.connect()
+            row = connection.execute('SELECT verdict FROM verdicts WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            connection.execute('UPDATE verdicts SET lastUsed = ? WHERE key = ?', (time.time(), key))
+            return bool(row[0])
+        except sqlite3.Error:
+            # A broken cache must never break the test itself
+            return None
+
+    def put(self, key, verdict):
+        try:
+            connection = self.connect()
+            connection.execute('INSERT OR REPLACE INTO verdicts (key, verdict, lastUsed) VALUES (?, ?, ?)', (key, int(verdict), time.time()))
+
+            # Counting is expensive, the keys are hashes and pick about every n-th put to check the size
+            if int(key[:8], 16) % self.evictionInterval == 0:
+                self.evict()
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            count = connection.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+
+            # Evict least recently used verdicts
+            if count > self.maxEntries:
+                connection.execute('DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY lastUsed LIMIT ?)', (count - self.maxEntries,))
+
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+def getVerdictCache():
+    cacheFile = os.environ.get('CREDUCE_TEST_CACHE')
+
+    if not cacheFile:
+        return None
+
+    return VerdictCache(cacheFile, int(os.environ.get('CREDUCE_TEST_CACHE_SIZE', 100000)))